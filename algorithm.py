@@ -1,96 +1,65 @@
+import heapq
+
 import vtk
 import ipdb
 from vtk.util import numpy_support
 import numpy as np
 
+from meshcache import gatherRows, getMeshCache
+from selection import Selection
+
+try:
+    from scipy.sparse import coo_matrix, csr_matrix
+    from scipy.sparse.csgraph import connected_components, dijkstra
+except ImportError:
+    connected_components = None
+    dijkstra = None
+
 
 def addSelection(ids, new_ids):
-    originIds = set([ids.GetValue(i) for i in range(ids.GetNumberOfValues())])
-    newIds = set(
-        [new_ids.GetValue(i) for i in range(new_ids.GetNumberOfValues())])
+    return numpyToIdArray(
+        np.union1d(idArrayToNumpy(ids), idArrayToNumpy(new_ids)))
 
-    sumIds = originIds.union(newIds)
 
-    sum_ids = vtk.vtkIdTypeArray()
-    sum_ids.SetNumberOfComponents(1)
-    for id in sumIds:
-        sum_ids.InsertNextValue(id)
+def minusSelection(ids, new_ids):
+    return numpyToIdArray(
+        np.setdiff1d(idArrayToNumpy(ids), idArrayToNumpy(new_ids)))
 
-    return sum_ids
 
+def inverseSelection(polyData, selected_ids):
+    return Selection.fromIds(polyData.GetNumberOfCells(),
+                             selected_ids).complement().toIdArray()
 
-def minusSelection(ids, new_ids):
-    originIds = set([ids.GetValue(i) for i in range(ids.GetNumberOfValues())])
-    newIds = set(
-        [new_ids.GetValue(i) for i in range(new_ids.GetNumberOfValues())])
 
-    difIds = originIds.difference(newIds)
+def onSelectedExpand(polyData, ids, selected_ids):
+    """ Expand from the initial cells through the selected cells only.
 
-    dif_ids = vtk.vtkIdTypeArray()
-    dif_ids.SetNumberOfComponents(1)
-    for id in difIds:
-        dif_ids.InsertNextValue(id)
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            ids (vtkIdTypeArray): initial cells.
+            selected_ids (vtkIdTypeArray): selected cells.
 
-    return dif_ids
+        Returns:
+            vtkIdTypeArray: cells connected to the initial cells within the
+                selection, empty if no initial cell is selected.
+    """
+    return numpyToIdArray(
+        collectRings(onSelectedExpandRings(polyData, ids, selected_ids)))
 
 
-def inverseSelection(polyData, selected_ids):
-    selectedCellIds = set([
-        selected_ids.GetValue(i)
-        for i in range(selected_ids.GetNumberOfValues())
-    ])
-    allIds = set(range(polyData.GetNumberOfCells()))
-    inverseIds = allIds.difference(selectedCellIds)
+def onSelectedExpandRings(polyData, ids, selected_ids):
+    """ Ring by ring version of `onSelectedExpand`, see `growRings`. """
+    cellIds = idArrayToNumpy(ids)
+    selected = np.zeros(polyData.GetNumberOfCells(), dtype=bool)
+    selected[idArrayToNumpy(selected_ids)] = True
 
-    dif_ids = vtk.vtkIdTypeArray()
-    dif_ids.SetNumberOfComponents(1)
-    for id in inverseIds:
-        dif_ids.InsertNextValue(id)
+    if not selected[cellIds].any():
+        return iter(())
 
-    return dif_ids
+    return growRings(polyData, cellIds, gate=lambda newIds: selected[newIds])
 
 
-def onSelectedExpand(polyData, ids, selected_ids):
-    selectedCellIds = set([
-        selected_ids.GetValue(i)
-        for i in range(selected_ids.GetNumberOfValues())
-    ])
-    cellIds = set([ids.GetValue(i) for i in range(ids.GetNumberOfValues())])
-    newCellIds = cellIds
-
-    new_ids = vtk.vtkIdTypeArray()
-    new_ids.SetNumberOfComponents(1)
-
-    if len(cellIds.intersection(selectedCellIds)) > 0:
-        polyData.BuildLinks()
-        while newCellIds:
-            temp_newCellIds = set()
-            for cellId in newCellIds:
-                cellPointIds = vtk.vtkIdList()
-                polyData.GetCellPoints(cellId, cellPointIds)
-                for j in range(cellPointIds.GetNumberOfIds()):
-                    for k in range(j, cellPointIds.GetNumberOfIds()):
-                        if polyData.IsEdge(
-                                cellPointIds.GetId(j), cellPointIds.GetId(k)):
-                            neighborCellIds = vtk.vtkIdList()
-                            polyData.GetCellEdgeNeighbors(cellId,
-                                                        cellPointIds.GetId(j),
-                                                        cellPointIds.GetId(k),
-                                                        neighborCellIds)
-                            for l in range(neighborCellIds.GetNumberOfIds()):
-                                new_id = neighborCellIds.GetId(l)
-                                if new_id in selectedCellIds:
-                                    temp_newCellIds.add(new_id)
-            newCellIds = temp_newCellIds - cellIds
-            cellIds.update(newCellIds)
-
-        for id in cellIds:
-            new_ids.InsertNextValue(id)
-
-    return new_ids
-
-
-def multiThresholdExpand(polyData, ids, distance, angle):
+def multiThresholdExpand(polyData, ids, distance, angle, cancelEvent=None):
     """ MultiThresholdExpand algorithm.
 
         Args:
@@ -99,112 +68,701 @@ def multiThresholdExpand(polyData, ids, distance, angle):
             distance (int): Largest number of cell to be passed through in expansion.
             angle (float): Largest angle difference between inital cell and expanded
                 cells.
+            cancelEvent (threading.Event): see `collectRings`.
     """
-    cellIds = set([ids.GetValue(i) for i in range(ids.GetNumberOfValues())])
-    newCellIds = cellIds
-
-    normals = getNormals(polyData)
-    origin_norm = np.mean([normals[id] for id in cellIds], axis=0)
-
-    polyData.BuildLinks()
-
-    for i in range(distance):
-        temp_newCellIds = set()
-        for cellId in newCellIds:
-            cellPointIds = vtk.vtkIdList()
-            polyData.GetCellPoints(cellId, cellPointIds)
-            for j in range(cellPointIds.GetNumberOfIds()):
-                for k in range(j, cellPointIds.GetNumberOfIds()):
-                    if polyData.IsEdge(
-                            cellPointIds.GetId(j), cellPointIds.GetId(k)):
-                        neighborCellIds = vtk.vtkIdList()
-                        polyData.GetCellEdgeNeighbors(cellId,
-                                                      cellPointIds.GetId(j),
-                                                      cellPointIds.GetId(k),
-                                                      neighborCellIds)
-                        for l in range(neighborCellIds.GetNumberOfIds()):
-                            new_id = neighborCellIds.GetId(l)
-                            if np.degrees(np.pi - np.arccos(
-                                    np.sum(normals[new_id] * origin_norm))
-                                          ) > angle:
-                                temp_newCellIds.add(new_id)
-        newCellIds = temp_newCellIds - cellIds
-        cellIds.update(newCellIds)
-
-    new_ids = vtk.vtkIdTypeArray()
-    new_ids.SetNumberOfComponents(1)
-    for id in cellIds:
-        new_ids.InsertNextValue(id)
-
-    return new_ids
+    return numpyToIdArray(
+        collectRings(multiThresholdExpandRings(polyData, ids, distance, angle),
+                     cancelEvent))
 
 
-def neighborExpand(polyData, ids, threshold):
+def multiThresholdExpandRings(polyData, ids, distance, angle):
+    """ Ring by ring version of `multiThresholdExpand`, see `growRings`. """
+    cellIds = idArrayToNumpy(ids)
+    return growRings(polyData,
+                     cellIds,
+                     gate=angleGate(polyData, cellIds, angle),
+                     rings=distance)
+
+
+def angleGate(polyData, cellIds, angle):
+    """ Angle test of `multiThresholdExpand`.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            cellIds (np.ndarray): initial cells.
+            angle (float): angle threshold in degrees.
+
+        Returns:
+            callable: takes cell ids and returns a bool mask of the cells
+                passing the test against the mean normal of `cellIds`.
+    """
+    normals = getCellNormals(polyData)
+    origin_norm = np.mean(normals[cellIds], axis=0)
+
+    def gate(newIds):
+        return np.degrees(np.pi - np.arccos(
+            np.sum(normals[newIds] * origin_norm, axis=1))) > angle
+
+    return gate
 
-    cellIds = set([ids.GetValue(i) for i in range(ids.GetNumberOfValues())])
-    newCellIds = cellIds
 
-    for i in range(threshold):
-        temp_newCellIds = set()
-        for cellId in newCellIds:
-            cellPointIds = vtk.vtkIdList()
-            polyData.GetCellPoints(cellId, cellPointIds)
-            for j in range(cellPointIds.GetNumberOfIds()):
-                pointId = vtk.vtkIdList()
-                pointId.InsertNextId(cellPointIds.GetId(j))
-                neighborCellIds = vtk.vtkIdList()
-                polyData.GetCellNeighbors(cellId, pointId, neighborCellIds)
-                for k in range(neighborCellIds.GetNumberOfIds()):
-                    temp_newCellIds.add(neighborCellIds.GetId(k))
-        newCellIds = temp_newCellIds - cellIds
-        cellIds.update(newCellIds)
+def geodesicExpand(polyData, ids, radius, angle, cancelEvent=None):
+    """ Expand by surface distance instead of number of rings.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            ids (vtkIdTypeArray): initial cells.
+            radius (float): largest surface distance, in mesh units (mm),
+                between the initial cells and expanded cells, measured along
+                the centroids of cells sharing an edge.
+            angle (float): same angle test as `multiThresholdExpand`.
+            cancelEvent (threading.Event): see `collectRings`.
+
+        Returns:
+            vtkIdTypeArray: cells of the region.
+    """
+    return numpyToIdArray(
+        collectRings(geodesicExpandRings(polyData, ids, radius, angle),
+                     cancelEvent))
 
-    new_ids = vtk.vtkIdTypeArray()
-    new_ids.SetNumberOfComponents(1)
-    for id in cellIds:
-        new_ids.InsertNextValue(id)
 
-    return new_ids
+def geodesicExpandRings(polyData, ids, radius, angle, chunk=4096):
+    """ Incremental version of `geodesicExpand`.
+
+        Cells are settled in order of distance with a Dijkstra search over
+        the centroid graph, so the work is proportional to the size of the
+        region. Cells failing the angle test are neither added nor crossed.
+
+        Args:
+            chunk (int): number of settled cells per yield.
+
+        Yields:
+            np.ndarray: ids of the cells settled since the previous yield,
+                the initial cells first.
+    """
+    cellIds = np.unique(idArrayToNumpy(ids))
+    gate = angleGate(polyData, cellIds, angle)
+    indptr, indices, lengths = getCentroidGraph(polyData)
+
+    yield cellIds
+
+    seeds = set(cellIds.tolist())
+    settled = set()
+    distances = dict.fromkeys(seeds, 0.0)
+    passed = dict.fromkeys(seeds, True)
+    heap = [(0.0, cellId) for cellId in seeds]
+    batch = list()
+    while heap:
+        distance, cellId = heapq.heappop(heap)
+        if cellId in settled:
+            continue
+        settled.add(cellId)
+        if cellId not in seeds:
+            batch.append(cellId)
+            if len(batch) >= chunk:
+                yield np.array(batch, dtype=np.int64)
+                batch = list()
+
+        start, end = indptr[cellId], indptr[cellId + 1]
+        neighbors = indices[start:end].tolist()
+        unknown = [n for n in neighbors if n not in passed]
+        if unknown:
+            passed.update(zip(unknown, gate(np.array(unknown)).tolist()))
+        for neighbor, length in zip(neighbors, lengths[start:end].tolist()):
+            newDistance = distance + length
+            if (newDistance <= radius and passed[neighbor] and
+                    newDistance < distances.get(neighbor, np.inf)):
+                distances[neighbor] = newDistance
+                heapq.heappush(heap, (newDistance, neighbor))
+
+    if batch:
+        yield np.array(batch, dtype=np.int64)
+
+
+def neighborExpand(polyData, ids, threshold):
+
+    return numpyToIdArray(
+        collectRings(neighborExpandRings(polyData, ids, threshold)))
+
+
+def neighborExpandRings(polyData, ids, threshold):
+    """ Ring by ring version of `neighborExpand`, see `growRings`. """
+    return growRings(polyData, idArrayToNumpy(ids), rings=threshold)
 
 
 def angleExpand(polyData, ids, threshold):
 
-    cellIds = set([ids.GetValue(i) for i in range(ids.GetNumberOfValues())])
-    newCellIds = cellIds
-
-    normals = getNormals(polyData)
-    origin_norm = np.mean([normals[id] for id in cellIds], axis=0)
-
-    polyData.BuildLinks()
-
-    while newCellIds:
-        temp_newCellIds = set()
-        for cellId in newCellIds:
-            cellPointIds = vtk.vtkIdList()
-            polyData.GetCellPoints(cellId, cellPointIds)
-            for j in range(cellPointIds.GetNumberOfIds()):
-                for k in range(j, cellPointIds.GetNumberOfIds()):
-                    if polyData.IsEdge(
-                            cellPointIds.GetId(j), cellPointIds.GetId(k)):
-                        neighborCellIds = vtk.vtkIdList()
-                        polyData.GetCellEdgeNeighbors(cellId,
-                                                      cellPointIds.GetId(j),
-                                                      cellPointIds.GetId(k),
-                                                      neighborCellIds)
-                        for l in range(neighborCellIds.GetNumberOfIds()):
-                            new_id = neighborCellIds.GetId(l)
-                            if np.abs(np.sum(normals[new_id] *
-                                             origin_norm)) > threshold:
-                                temp_newCellIds.add(new_id)
-        newCellIds = temp_newCellIds - cellIds
-        cellIds.update(newCellIds)
-
-    new_ids = vtk.vtkIdTypeArray()
-    new_ids.SetNumberOfComponents(1)
-    for id in cellIds:
-        new_ids.InsertNextValue(id)
-
-    return new_ids
+    return numpyToIdArray(
+        collectRings(angleExpandRings(polyData, ids, threshold)))
+
+
+def angleExpandRings(polyData, ids, threshold):
+    """ Ring by ring version of `angleExpand`, see `growRings`. """
+    cellIds = idArrayToNumpy(ids)
+
+    normals = getCellNormals(polyData)
+    origin_norm = np.mean(normals[cellIds], axis=0)
+
+    def gate(newIds):
+        return np.abs(np.sum(normals[newIds] * origin_norm,
+                             axis=1)) > threshold
+
+    return growRings(polyData, cellIds, gate=gate)
+
+
+def curvatureExpand(polyData,
+                    ids,
+                    curvature,
+                    distance=None,
+                    angle=None,
+                    cancelEvent=None):
+    """ Expand until high curvature boundaries, such as the gum line.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            ids (vtkIdTypeArray): initial cells.
+            curvature (float): largest absolute mean curvature, in 1/mm, of
+                the expanded cells. Cells above it are neither added nor
+                crossed.
+            distance (int): largest number of rings, None for no limit.
+            angle (float): same angle test as `multiThresholdExpand`, None
+                for no angle test.
+            cancelEvent (threading.Event): see `collectRings`.
+
+        Returns:
+            vtkIdTypeArray: cells of the region.
+    """
+    return numpyToIdArray(
+        collectRings(
+            curvatureExpandRings(polyData, ids, curvature, distance, angle),
+            cancelEvent))
+
+
+def curvatureExpandRings(polyData, ids, curvature, distance=None, angle=None):
+    """ Ring by ring version of `curvatureExpand`, see `growRings`. """
+    cellIds = idArrayToNumpy(ids)
+    gate = curvatureGate(polyData, curvature)
+    if angle is not None:
+        gate = bothGates(gate, angleGate(polyData, cellIds, angle))
+    return growRings(polyData, cellIds, gate=gate, rings=distance)
+
+
+def curvatureGate(polyData, curvature):
+    """ Curvature test of `curvatureExpand`.
+
+        Returns:
+            callable: takes cell ids and returns a bool mask of the cells of
+                absolute mean curvature up to `curvature`.
+    """
+    meanCurvature = getCellMeanCurvature(polyData)
+
+    def gate(newIds):
+        return np.abs(meanCurvature[newIds]) <= curvature
+
+    return gate
+
+
+def bothGates(first, second):
+    """ Gate passing the cells that pass two gates. """
+
+    def gate(newIds):
+        passed = first(newIds)
+        passed[passed] = second(newIds[passed])
+        return passed
+
+    return gate
+
+
+class ExpansionCancelled(Exception):
+    """Raised when an expansion is cancelled through its cancel event."""
+
+
+def growRings(polyData, ids, gate=None, rings=None):
+    """ Grow a region ring by ring over the cells sharing a point.
+
+        Every ring is handled at once with array operations over the cached
+        cell adjacency of the mesh.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            ids (np.ndarray): initial cells, always part of the region.
+            gate (callable): takes the ids of candidate cells and returns a
+                bool mask of the ones allowed into the region. None to accept
+                every cell.
+            rings (int): largest number of rings to grow, None to grow until
+                no cell can be added.
+
+        Yields:
+            np.ndarray: sorted ids of the cells added by each ring, the
+                initial cells first.
+    """
+    cache = getMeshCache(polyData)
+    visited = np.zeros(cache.numberOfCells, dtype=bool)
+
+    frontier = np.unique(ids)
+    visited[frontier] = True
+    yield frontier
+
+    ring = 0
+    while frontier.shape[0] > 0 and (rings is None or ring < rings):
+        newIds = cache.neighbors(frontier)
+        newIds = np.unique(newIds[~visited[newIds]])
+        if gate is not None:
+            newIds = newIds[gate(newIds)]
+        visited[newIds] = True
+        if newIds.shape[0] > 0:
+            yield newIds
+        frontier = newIds
+        ring += 1
+
+
+def collectRings(rings, cancelEvent=None):
+    """ Run a ring generator to the end.
+
+        Args:
+            rings (iterable): rings of cell ids, from `growRings`.
+            cancelEvent (threading.Event): checked after every ring, raises
+                ExpansionCancelled once it is set.
+
+        Returns:
+            np.ndarray: sorted ids of the cells of the region.
+    """
+    region = [np.empty(0, dtype=np.int64)]
+    for ring in rings:
+        if cancelEvent is not None and cancelEvent.is_set():
+            raise ExpansionCancelled()
+        region.append(ring)
+    return np.sort(np.concatenate(region))
+
+
+def labelComponents(polyData, mask):
+    """ Label the connected components of a set of cells.
+
+        Cells are connected when they share a point, as in the expansions.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            mask (np.ndarray): bool mask of the cells to be labeled.
+
+        Returns:
+            tuple: number of components, and component of each cell of the
+                mesh (-1 for cells outside `mask`).
+    """
+    cache = getMeshCache(polyData)
+    indptr, indices = cache.adjacency
+    cells = np.flatnonzero(mask)
+
+    # Edges between cells of the mask, in indices local to `cells`
+    local = np.full(cache.numberOfCells, -1, dtype=np.int64)
+    local[cells] = np.arange(cells.shape[0])
+    neighbors = gatherRows(indptr, indices, cells)
+    sources = np.repeat(local[cells], np.diff(indptr)[cells])
+    targets = local[neighbors]
+    keep = targets > sources
+    sources, targets = sources[keep], targets[keep]
+
+    if connected_components is not None:
+        graph = coo_matrix((np.ones(sources.shape[0], dtype=np.int8),
+                            (sources, targets)),
+                           shape=(cells.shape[0], cells.shape[0]))
+        count, components = connected_components(graph, directed=False)
+    else:
+        count, components = _connectedComponents(cells.shape[0], sources,
+                                                 targets)
+
+    labels = np.full(cache.numberOfCells, -1, dtype=np.int64)
+    labels[cells] = components
+    return count, labels
+
+
+def _connectedComponents(numberOfNodes, sources, targets):
+    """Connected components by vectorized hooking and pointer jumping."""
+    parent = np.arange(numberOfNodes)
+    while True:
+        rootSources, rootTargets = parent[sources], parent[targets]
+        changed = rootSources != rootTargets
+        if not changed.any():
+            break
+        # Hook the larger root under the smaller one, then flatten the trees
+        np.minimum.at(parent,
+                      np.maximum(rootSources, rootTargets)[changed],
+                      np.minimum(rootSources, rootTargets)[changed])
+        while True:
+            grandParent = parent[parent]
+            if np.array_equal(grandParent, parent):
+                break
+            parent = grandParent
+    roots, components = np.unique(parent, return_inverse=True)
+    return roots.shape[0], components
+
+
+def cleanSelection(polyData,
+                   mask,
+                   seeds=None,
+                   keepLargest=False,
+                   minCells=0,
+                   minArea=0.0,
+                   maxHoleCells=0,
+                   maxHoleArea=0.0):
+    """ Clean a selection by its connected components.
+
+        Components are labeled once for the whole selection, then filtered
+        by every given option.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            mask (np.ndarray): bool mask of the selected cells.
+            seeds (np.ndarray): keep only the components containing one of
+                these cells.
+            keepLargest (bool): keep only the component with most cells.
+            minCells (int): drop components of fewer cells.
+            minArea (float): drop components of smaller area.
+            maxHoleCells (int): fill holes of at most this number of cells.
+            maxHoleArea (float): fill holes of at most this area.
+
+        Holes are the unselected components enclosed by the selection:
+        touching it, away from the border of the mesh, and not the largest
+        unselected component of their piece of the mesh, which is the
+        background on closed surfaces. Unselected pieces of the mesh, such
+        as debris islands, are never filled.
+
+        Returns:
+            np.ndarray: bool mask of the cleaned selection.
+    """
+    count, labels = labelComponents(polyData, mask)
+    cells = np.flatnonzero(mask)
+    keep = np.ones(count, dtype=bool)
+
+    sizes = np.bincount(labels[cells], minlength=count)
+    if seeds is not None:
+        seedLabels = labels[np.asarray(seeds, dtype=np.int64)]
+        touched = np.zeros(count, dtype=bool)
+        touched[seedLabels[seedLabels >= 0]] = True
+        keep &= touched
+    if keepLargest and count > 0:
+        largest = np.zeros(count, dtype=bool)
+        largest[np.argmax(sizes)] = True
+        keep &= largest
+    if minCells > 0:
+        keep &= sizes >= minCells
+    if minArea > 0:
+        areas = np.bincount(labels[cells],
+                            weights=getCellAreas(polyData)[cells],
+                            minlength=count)
+        keep &= areas >= minArea
+
+    cleaned = np.zeros(mask.shape[0], dtype=bool)
+    cleaned[cells] = keep[labels[cells]]
+
+    if maxHoleCells > 0 or maxHoleArea > 0:
+        holeCount, holeLabels = labelComponents(polyData, ~cleaned)
+        holes = np.flatnonzero(~cleaned)
+        holeSizes = np.bincount(holeLabels[holes], minlength=holeCount)
+        fill = np.zeros(holeCount, dtype=bool)
+        if maxHoleCells > 0:
+            fill |= holeSizes <= maxHoleCells
+        if maxHoleArea > 0:
+            fill |= np.bincount(holeLabels[holes],
+                                weights=getCellAreas(polyData)[holes],
+                                minlength=holeCount) <= maxHoleArea
+        fill &= _enclosedComponents(polyData, cleaned, holeCount, holeLabels,
+                                    holeSizes)
+        cleaned[holes] = fill[holeLabels[holes]]
+
+    return cleaned
+
+
+def _enclosedComponents(polyData, mask, count, labels, sizes):
+    """Unselected components enclosed by a selection, see `cleanSelection`.
+
+    Args:
+        polyData (vtkPolyData): polydata to be processed.
+        mask (np.ndarray): bool mask of the selected cells.
+        count (int): number of unselected components.
+        labels (np.ndarray): component of each cell, -1 for selected cells.
+        sizes (np.ndarray): number of cells of each component.
+
+    Returns:
+        np.ndarray: bool mask of the enclosed components.
+    """
+    cache = getMeshCache(polyData)
+    enclosed = np.zeros(count, dtype=bool)
+    neighbors = cache.neighbors(np.flatnonzero(mask))
+    enclosed[labels[neighbors[~mask[neighbors]]]] = True
+
+    # Cells with an edge used by no other cell are on the mesh border
+    graphIndptr = getCentroidGraph(polyData)[0]
+    border = np.diff(graphIndptr) < np.diff(cache.cellPoints[0])
+    enclosed[labels[border & ~mask]] = False
+
+    # The largest component of each piece of the mesh is its background
+    _, pieces = labelComponents(polyData,
+                                np.ones(cache.numberOfCells, dtype=bool))
+    cells = np.flatnonzero(~mask)
+    first = np.zeros(count, dtype=np.int64)
+    first[labels[cells[::-1]]] = cells[::-1]
+    piece = pieces[first]
+    order = np.lexsort((-sizes, piece))
+    largest = np.ones(count, dtype=bool)
+    largest[order[1:]] = piece[order[1:]] != piece[order[:-1]]
+    enclosed[largest] = False
+    return enclosed
+
+
+def dilateSelection(polyData, mask, rings=1, radius=None):
+    """ Grow a selection by a number of rings or a surface distance.
+
+        Only the cells around the boundary of the selection are visited,
+        ring by ring over the cached cell adjacency, or by a multi-source
+        Dijkstra search over the centroid graph for a distance.
+
+        Args:
+            polyData (vtkPolyData): polydata to be processed.
+            mask (np.ndarray): bool mask of the selected cells.
+            rings (int): number of rings of cells sharing a point added.
+            radius (float): largest surface distance, in mesh units (mm),
+                of the added cells to the selection, as in
+                `geodesicExpand`. Used instead of `rings` if given.
+
+        Returns:
+            np.ndarray: bool mask of the dilated selection.
+    """
+    cache = getMeshCache(polyData)
+    dilated = mask.copy()
+    frontier = _selectionBoundary(cache, mask)
+    if radius is not None:
+        if frontier.shape[0] > 0:
+            dilated |= _surfaceDistances(polyData, frontier, radius) <= radius
+        return dilated
+
+    for _ in range(rings):
+        if frontier.shape[0] == 0:
+            break
+        newIds = cache.neighbors(frontier)
+        newIds = np.unique(newIds[~dilated[newIds]])
+        dilated[newIds] = True
+        frontier = newIds
+    return dilated
+
+
+def erodeSelection(polyData, mask, rings=1, radius=None):
+    """ Shrink a selection by a number of rings or a surface distance.
+
+        Dual of `dilateSelection`: the unselected cells are dilated.
+
+        Returns:
+            np.ndarray: bool mask of the eroded selection.
+    """
+    return ~dilateSelection(polyData, ~mask, rings, radius)
+
+
+def openSelection(polyData, mask, rings=1, radius=None):
+    """ Erode then dilate a selection, removing spurs and thin bridges.
+
+        Returns:
+            np.ndarray: bool mask of the opened selection.
+    """
+    return dilateSelection(polyData,
+                           erodeSelection(polyData, mask, rings, radius),
+                           rings, radius)
+
+
+def closeSelection(polyData, mask, rings=1, radius=None):
+    """ Dilate then erode a selection, filling notches and narrow gaps.
+
+        Returns:
+            np.ndarray: bool mask of the closed selection.
+    """
+    return erodeSelection(polyData,
+                          dilateSelection(polyData, mask, rings, radius),
+                          rings, radius)
+
+
+def _selectionBoundary(cache, mask):
+    """Selected cells sharing a point with an unselected cell."""
+    indptr, indices = cache.adjacency
+    selected = mask.sum()
+    # Scan the smaller side, the boundary is found from either
+    if selected <= cache.numberOfCells - selected:
+        cells = np.flatnonzero(mask)
+        outside = ~mask[gatherRows(indptr, indices, cells)]
+        rows = np.repeat(np.arange(cells.shape[0]), np.diff(indptr)[cells])
+        return np.unique(cells[rows[outside]])
+    neighbors = cache.neighbors(np.flatnonzero(~mask))
+    return np.unique(neighbors[mask[neighbors]])
+
+
+def _surfaceDistances(polyData, sources, radius):
+    """Surface distance of each cell to the nearest of `sources`.
+
+    Distances are measured along the centroid graph and only up to
+    `radius`, farther cells are at infinity.
+    """
+    indptr, indices, lengths = getCentroidGraph(polyData)
+    numberOfCells = indptr.shape[0] - 1
+    if dijkstra is not None:
+        graph = csr_matrix((lengths, indices, indptr),
+                           shape=(numberOfCells, numberOfCells))
+        return dijkstra(graph, indices=sources, limit=radius, min_only=True)
+
+    distances = np.full(numberOfCells, np.inf)
+    distances[sources] = 0.0
+    heap = [(0.0, cellId) for cellId in sources.tolist()]
+    while heap:
+        distance, cellId = heapq.heappop(heap)
+        if distance > distances[cellId]:
+            continue
+        start, end = indptr[cellId], indptr[cellId + 1]
+        for neighbor, length in zip(indices[start:end].tolist(),
+                                    lengths[start:end].tolist()):
+            newDistance = distance + length
+            if newDistance <= radius and newDistance < distances[neighbor]:
+                distances[neighbor] = newDistance
+                heapq.heappush(heap, (newDistance, neighbor))
+    return distances
+
+
+def idArrayToNumpy(ids):
+    """Convert a vtkIdTypeArray to an int64 numpy array."""
+    return numpy_support.vtk_to_numpy(ids).astype(np.int64)
+
+
+def numpyToIdArray(ids):
+    """Convert a numpy array of ids to a vtkIdTypeArray."""
+    return numpy_support.numpy_to_vtk(np.ascontiguousarray(ids, np.int64),
+                                      deep=1,
+                                      array_type=vtk.VTK_ID_TYPE)
+
+
+def cacheGeometry(polyData):
+    """Fill the geometry cache of a mesh.
+
+    Args:
+        polyData (vtkPolyData): polydata to be processed.
+    """
+    getCellNormals(polyData)
+    getCellCentroids(polyData)
+    getCellAreas(polyData)
+    getCellCurvature(polyData)
+    getCellMeanCurvature(polyData)
+    getCentroidGraph(polyData)
+
+
+def getCentroidGraph(polyData):
+    """Graph of the centroids of cells sharing an edge, computed once.
+
+    Returns:
+        tuple: CSR (indptr, indices) of the edge neighbors of each cell and
+            the centroid to centroid length of each edge of the graph.
+    """
+    cache = getMeshCache(polyData)
+    if cache.centroidGraph is None:
+        indptr, indices = cache.adjacency
+        rows = np.repeat(np.arange(cache.numberOfCells), np.diff(indptr))
+        edge = cache.sharedPoints >= 2
+        rows, indices = rows[edge], indices[edge]
+
+        graphIndptr = np.zeros(cache.numberOfCells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=cache.numberOfCells),
+                  out=graphIndptr[1:])
+        centroids = getCellCentroids(polyData)
+        lengths = np.linalg.norm(centroids[rows] - centroids[indices], axis=1)
+        cache.centroidGraph = (graphIndptr, indices, lengths)
+    return cache.centroidGraph
+
+
+def getCellNormals(polyData):
+    """Cell normals of a mesh, computed once per geometry.
+
+    Returns:
+        np.ndarray: (N, 3) consistent normal of each cell.
+    """
+    cache = getMeshCache(polyData)
+    if cache.cellNormals is None:
+        cache.cellNormals = getNormals(polyData)
+    return cache.cellNormals
+
+
+def getCellCentroids(polyData):
+    """Cell centroids of a mesh, computed once per geometry.
+
+    Returns:
+        np.ndarray: (N, 3) mean of the points of each cell.
+    """
+    cache = getMeshCache(polyData)
+    if cache.cellCentroids is None:
+        points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+        cache.cellCentroids = _cellMean(cache, points.astype(np.float64))
+    return cache.cellCentroids
+
+
+def getCellAreas(polyData):
+    """Cell areas of a mesh, computed once per geometry.
+
+    Returns:
+        np.ndarray: (N,) area of each cell.
+    """
+    cache = getMeshCache(polyData)
+    if cache.cellAreas is None:
+        offsets, connectivity = cache.cellPoints
+        points = numpy_support.vtk_to_numpy(
+            polyData.GetPoints().GetData()).astype(np.float64)
+        # Shoelace formula: half the norm of the summed cross products of
+        # consecutive points, wrapping around at the end of each cell.
+        following = np.arange(1, connectivity.shape[0] + 1)
+        following[offsets[1:] - 1] = offsets[:-1]
+        crosses = np.cross(points[connectivity],
+                           points[connectivity[following]])
+        cache.cellAreas = 0.5 * np.linalg.norm(
+            _cellSum(cache, crosses), axis=1)
+    return cache.cellAreas
+
+
+def getCellCurvature(polyData):
+    """Gaussian curvature of the cells of a mesh, computed once per geometry.
+
+    Returns:
+        np.ndarray: (N,) mean Gaussian curvature of the points of each cell.
+    """
+    cache = getMeshCache(polyData)
+    if cache.cellCurvature is None:
+        cache.pointCurvature = numpy_support.vtk_to_numpy(
+            getCurvature(polyData).GetPointData().GetArray(
+                "Gauss_Curvature")).astype(np.float64)
+        cache.cellCurvature = _cellMean(cache, cache.pointCurvature)
+    return cache.cellCurvature
+
+
+def getCellMeanCurvature(polyData):
+    """Mean curvature of the cells of a mesh, computed once per geometry.
+
+    Returns:
+        np.ndarray: (N,) mean of the mean curvature of the points of each
+            cell.
+    """
+    cache = getMeshCache(polyData)
+    if cache.cellMeanCurvature is None:
+        cache.pointMeanCurvature = numpy_support.vtk_to_numpy(
+            getMeanCurvature(polyData).GetPointData().GetArray(
+                "Mean_Curvature")).astype(np.float64)
+        cache.cellMeanCurvature = _cellMean(cache, cache.pointMeanCurvature)
+    return cache.cellMeanCurvature
+
+
+def _cellSum(cache, values):
+    """Sum values given per cell point (in connectivity order) over cells."""
+    offsets = cache.cellPoints[0]
+    if cache.numberOfCells == 0:
+        return np.zeros((0, ) + values.shape[1:])
+    return np.add.reduceat(values, offsets[:-1], axis=0)
+
+
+def _cellMean(cache, pointValues):
+    """Average values given per point over the points of each cell."""
+    offsets, connectivity = cache.cellPoints
+    sums = _cellSum(cache, pointValues[connectivity])
+    counts = np.diff(offsets)
+    return sums / counts.reshape((-1, ) + (1, ) * (sums.ndim - 1))
 
 
 def getCurvature(polyData):
@@ -216,6 +774,15 @@ def getCurvature(polyData):
     return curvaturesFilter.GetOutput()
 
 
+def getMeanCurvature(polyData):
+    curvaturesFilter = vtk.vtkCurvatures()
+    curvaturesFilter.SetInputData(polyData)
+    curvaturesFilter.SetCurvatureTypeToMean()
+    curvaturesFilter.Update()
+
+    return curvaturesFilter.GetOutput()
+
+
 def getNormals(polyData):
 
     normalFilter = vtk.vtkPolyDataNormals()
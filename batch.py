@@ -0,0 +1,257 @@
+"""Headless batch labeling.
+
+Replays a recorded operation script on every STL file of a directory with
+a process pool and writes the labeled meshes, without any display.
+
+The script is a JSON file such as::
+
+    {
+        "neighbor": 5,
+        "angle": 90,
+        "steps": [
+            {"mode": "SEL", "cells": [1024]},
+            {"mode": "ADD", "points": [[1.5, -3.2, 10.0]], "neighbor": 20},
+            {"mode": "DEL", "cells": [77], "angle": 60},
+            {"mode": "ADD", "cells": [2048], "radius": 2.5},
+            {"mode": "ADD", "rays": [[0, 0, 50, 0, 0, -1]]},
+            {"mode": "SEL", "cells": [512], "curvature": 0.8},
+            {"op": "inverse"},
+            {"op": "cleanOutlier"},
+            {"op": "cleanOutlier", "minCells": 200, "maxHoleCells": 50},
+            {"op": "close", "rings": 2},
+            {"op": "open", "radius": 0.3}
+        ]
+    }
+
+Selection steps seed the expansion with cell ids (`cells`), with the cells
+closest to coordinates (`points`) or with the cells first hit by rays given
+as origin and direction (`rays`), with the `neighbor` and `angle`
+thresholds of the script unless overridden by the step, and behave like the
+SEL/ADD/DEL modes of the viewer. Steps with a `radius` grow by surface
+distance in mm (geodesic expansion) instead of by `neighbor` rings, steps
+with a `curvature` grow up to cells of higher absolute mean curvature, in
+1/mm, without ring limit nor angle test.
+`cleanOutlier` keeps the selected cells connected to the seeds of the last
+selection step, or, given any of the `keepLargest`, `minCells`, `minArea`,
+`maxHoleCells` and `maxHoleArea` options of `algorithm.cleanSelection`,
+filters the connected components of the selection with them.
+`dilate`, `erode`, `open` and `close` smooth the boundary of the selection
+by `rings` rings of cells (1 by default) or, given a `radius`, by surface
+distance in mm.
+
+Usage:
+    python batch.py INPUT_DIR SCRIPT.json -o OUTPUT_DIR -j 8
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import vtk
+
+from algorithm import (cleanSelection, closeSelection, curvatureExpand,
+                       dilateSelection, erodeSelection, geodesicExpand,
+                       multiThresholdExpand, numpyToIdArray, openSelection)
+from picking import CellPicker
+from selection import Selection
+from vtkio import COMPRESSORS, labelPolyData, readSTLFast, writeVTP
+
+# Options of a cleanOutlier step, passed to `cleanSelection`
+CLEAN_OPTIONS = ('keepLargest', 'minCells', 'minArea', 'maxHoleCells',
+                 'maxHoleArea')
+
+# Morphology steps
+MORPHOLOGY = {
+    'dilate': dilateSelection,
+    'erode': erodeSelection,
+    'open': openSelection,
+    'close': closeSelection,
+}
+
+
+def seedIds(step, picker):
+    """Seed cell ids of a selection step.
+
+    Args:
+        step (dict): selection step with `cells`, `points` and/or `rays`.
+        picker (CellPicker): picker of the mesh, used for `points` and
+            `rays`.
+
+    Returns:
+        vtkIdTypeArray: seed cells.
+    """
+    ids = list(step.get('cells', []))
+    if step.get('points'):
+        closest = [0.0, 0.0, 0.0]
+        cellId = vtk.reference(0)
+        subId = vtk.reference(0)
+        distance = vtk.reference(0.0)
+        for point in step['points']:
+            picker.locator.FindClosestPoint(point, closest, cellId, subId,
+                                            distance)
+            ids.append(int(cellId))
+    if step.get('rays'):
+        rays = np.asarray(step['rays'], dtype=np.float64).reshape(-1, 6)
+        cellIds = picker.pickRays(rays[:, :3], rays[:, 3:])
+        ids.extend(cellIds[cellIds != -1].tolist())
+    return numpyToIdArray(np.array(ids, dtype=np.int64))
+
+
+def runScript(polyData, script):
+    """Apply an operation script to a mesh.
+
+    Args:
+        polyData (vtkPolyData): mesh to be labeled.
+        script (dict): operation script, see the module documentation.
+
+    Returns:
+        Selection: selected cells at the end of the script.
+    """
+    numberOfCells = polyData.GetNumberOfCells()
+    selection = Selection(numberOfCells)
+    ids = numpyToIdArray(np.empty(0, dtype=np.int64))
+    picker = None
+
+    for step in script['steps']:
+        mode = step.get('mode')
+        op = step.get('op')
+        if mode in ('SEL', 'ADD', 'DEL'):
+            if (step.get('points') or step.get('rays')) and picker is None:
+                picker = CellPicker(polyData)
+            ids = seedIds(step, picker)
+            angle = step.get('angle', script['angle'])
+            if 'radius' in step:
+                expandedIds = geodesicExpand(polyData, ids, step['radius'],
+                                             angle)
+            elif 'curvature' in step:
+                expandedIds = curvatureExpand(polyData, ids,
+                                              step['curvature'])
+            else:
+                expandedIds = multiThresholdExpand(
+                    polyData, ids, step.get('neighbor', script['neighbor']),
+                    angle)
+            expanded = Selection.fromIds(numberOfCells, expandedIds)
+            if mode == 'SEL':
+                selection = expanded
+            elif mode == 'ADD':
+                selection = selection | expanded
+            else:
+                selection = selection - expanded
+        elif op == 'inverse':
+            selection = ~selection
+        elif op == 'cleanOutlier':
+            options = {
+                key: step[key]
+                for key in CLEAN_OPTIONS if key in step
+            }
+            if not options:
+                options['seeds'] = ids
+            if selection:
+                selection = Selection(
+                    numberOfCells,
+                    cleanSelection(polyData, selection.mask, **options))
+        elif op in MORPHOLOGY:
+            selection = Selection(
+                numberOfCells,
+                MORPHOLOGY[op](polyData, selection.mask, step.get('rings', 1),
+                               step.get('radius')))
+        else:
+            raise ValueError('Unknown step: {}'.format(step))
+
+    return selection
+
+
+def labelFile(job):
+    """Label one STL file, meant to run in a worker process.
+
+    Args:
+        job (tuple): (input STL path, output VTP path, script, compression
+            of the VTP file).
+
+    Returns:
+        dict: file name, number of cells, selected cells and time in seconds
+            spent reading, labeling and writing, or the error raised.
+    """
+    inputPath, outputPath, script, compression = job
+    report = {'file': inputPath}
+    try:
+        start = time.perf_counter()
+        polyData = readSTLFast(inputPath)
+        report['read'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        selection = runScript(polyData, script)
+        report['label'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        writeVTP(labelPolyData(polyData, selection.mask), outputPath,
+                 compression)
+        report['write'] = time.perf_counter() - start
+
+        report['cells'] = polyData.GetNumberOfCells()
+        report['selected'] = len(selection)
+    except Exception as e:
+        report['error'] = repr(e)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Label a directory of STL files with a recorded script.')
+    parser.add_argument('input', help='directory of STL files')
+    parser.add_argument('script', help='JSON operation script')
+    parser.add_argument('-o', '--output', required=True,
+                        help='directory of the labeled VTP files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--compression', default='zlib',
+                        choices=sorted(COMPRESSORS),
+                        help='compression of the VTP files')
+    parser.add_argument('--report', help='write the timing report as JSON')
+    args = parser.parse_args(argv)
+
+    with open(args.script) as f:
+        script = json.load(f)
+    script.setdefault('neighbor', 5)
+    script.setdefault('angle', 90)
+
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(path,
+             os.path.join(args.output,
+                          os.path.splitext(os.path.basename(path))[0] +
+                          '.vtp'), script, args.compression)
+            for path in sorted(
+                set(
+                    glob.glob(os.path.join(args.input, '*.stl')) +
+                    glob.glob(os.path.join(args.input, '*.STL'))))]
+
+    reports = list()
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.jobs) as pool:
+        for report in pool.imap_unordered(labelFile, jobs):
+            reports.append(report)
+            if 'error' in report:
+                print('{file}: FAILED {error}'.format(**report))
+            else:
+                print('{file}: {cells} cells, {selected} selected, '
+                      'read {read:.3f}s label {label:.3f}s '
+                      'write {write:.3f}s'.format(**report))
+    total = time.perf_counter() - start
+
+    failed = sum('error' in report for report in reports)
+    print('{} files in {:.1f}s, {} failed'.format(len(reports), total,
+                                                  failed))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'total': total, 'files': reports}, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""Benchmarks of the algorithm module.
+
+Generates sphere meshes of increasing size and times the region growing
+functions, the selection set operations, the normal computation and the
+export path over a sweep of seeds, distances and angles. Results (wall
+time, peak memory and cells per second) are written as JSON so that runs
+of different commits can be compared. No display is needed.
+
+Usage:
+    python benchmark.py -o results.json
+    python benchmark.py --sizes 10000 100000 --repeat 5 -o quick.json
+    python benchmark.py --compare base.json results.json
+"""
+import argparse
+import ctypes
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import vtk
+
+from algorithm import (addSelection, angleExpand, cacheGeometry, getNormals,
+                       inverseSelection, minusSelection, multiThresholdExpand,
+                       neighborExpand, numpyToIdArray, onSelectedExpand)
+from meshcache import MeshCache
+from vtkio import labelPolyData, writeVTP
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 5000000]
+DEFAULT_DISTANCES = [5, 20, 100]
+DEFAULT_ANGLES = [45, 90, 135]
+DEFAULT_THRESHOLDS = [0.5, 0.9]
+
+
+def sphereMesh(numberOfCells):
+    """Triangulated sphere of about `numberOfCells` triangles.
+
+    Args:
+        numberOfCells (int): targeted number of triangles.
+
+    Returns:
+        vtkPolyData: sphere mesh.
+    """
+    resolution = max(int(np.sqrt(numberOfCells / 2.0)), 8)
+    source = vtk.vtkSphereSource()
+    source.SetRadius(10.0)
+    source.SetThetaResolution(resolution)
+    source.SetPhiResolution(resolution + 2)
+    source.Update()
+    return source.GetOutput()
+
+
+def currentRss():
+    """Resident set size of the process in bytes, None if unknown."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _trimHeap():
+    """Give the free heap memory back to the system, glibc only, so that
+    later allocations show in the resident size instead of reusing it."""
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _resetPeakRss():
+    """Reset the peak resident set size of the process, Linux only.
+
+    Returns:
+        bool: whether the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peakRss():
+    """Peak resident set size of the process in bytes, Linux only."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    raise OSError('VmHWM missing from /proc/self/status')
+
+
+class PeakMemory(object):
+    """Context manager measuring the peak memory used within it.
+
+    Resident memory is measured so that allocations of VTK count as well as
+    the ones of NumPy. The peak resident size is reset and read back on
+    Linux, sampled every millisecond with psutil elsewhere; without either,
+    only Python and NumPy allocations are traced.
+
+    Attributes:
+        peak (int): peak memory in bytes above the one at entry.
+        source (str): how the peak was measured, 'VmHWM', 'psutil' or
+            'tracemalloc'.
+    """
+
+    # Highest resident size seen, as resetting the peak on Linux also
+    # resets the one of getrusage
+    highest = 0
+
+    def __enter__(self):
+        self.peak = 0
+        _trimHeap()
+        self.baseline = currentRss()
+        if self.baseline is not None and _resetPeakRss():
+            self.source = 'VmHWM'
+        elif psutil is not None:
+            self.source = 'psutil'
+            self.high = self.baseline
+            self.stopped = threading.Event()
+            self.sampler = threading.Thread(target=self._sample)
+            self.sampler.start()
+        else:
+            self.source = 'tracemalloc'
+            tracemalloc.start()
+        return self
+
+    def _sample(self):
+        while not self.stopped.wait(0.001):
+            self.high = max(self.high, currentRss())
+
+    def __exit__(self, *exc):
+        if self.source == 'VmHWM':
+            high = _peakRss()
+        elif self.source == 'psutil':
+            self.stopped.set()
+            self.sampler.join()
+            high = max(self.high, currentRss())
+        else:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return False
+        self.peak = max(high - self.baseline, 0)
+        PeakMemory.highest = max(PeakMemory.highest, high)
+        return False
+
+
+def maxRss():
+    """Highest resident size of the process in bytes, None if unknown."""
+    highest = PeakMemory.highest
+    if resource is not None:
+        highest = max(highest,
+                      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+                      1024)
+    elif psutil is not None:
+        highest = max(highest,
+                      getattr(psutil.Process().memory_info(), 'peak_wset', 0))
+    return highest or None
+
+
+def memorySource():
+    """How `PeakMemory` measures on this platform."""
+    with PeakMemory() as memory:
+        pass
+    return memory.source
+
+
+def measure(function, repeat):
+    """Time a function and the peak memory it uses, see `PeakMemory`.
+
+    Runs are timed without measuring memory, the peak memory is measured on
+    one more run so that the measurement does not weigh on the times.
+
+    Args:
+        function (callable): function without arguments to be measured.
+        repeat (int): number of timed runs.
+
+    Returns:
+        tuple: wall time of each run in seconds, peak memory used during a
+            run in bytes, and the result of the last run.
+    """
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    with PeakMemory() as memory:
+        function()
+    return times, memory.peak, result
+
+
+def record(results, name, polyData, params, times, peak, cells):
+    """Append a benchmark entry to `results` and print it."""
+    best = min(times)
+    entry = {
+        'name': name,
+        'meshCells': polyData.GetNumberOfCells(),
+        'params': params,
+        'time': float(np.median(times)),
+        'minTime': best,
+        'times': times,
+        'peakMemory': peak,
+        'cells': cells,
+        'cellsPerSecond': cells / best if best > 0 else None,
+    }
+    results.append(entry)
+    print('{:<22} {:>9} {:<34} {:>9.4f}s {:>9.1f}MB {:>12.0f} cells/s'.format(
+        name, entry['meshCells'], json.dumps(params, sort_keys=True),
+        entry['time'], peak / 2**20, entry['cellsPerSecond'] or 0))
+
+
+def benchmarkMesh(results, polyData, seeds, distances, angles, thresholds,
+                  repeat, directory):
+    numberOfCells = polyData.GetNumberOfCells()
+
+    times, peak, _ = measure(lambda: MeshCache(polyData), repeat)
+    record(results, 'MeshCache', polyData, {}, times, peak, numberOfCells)
+    times, peak, _ = measure(lambda: getNormals(polyData), repeat)
+    record(results, 'getNormals', polyData, {}, times, peak, numberOfCells)
+    cacheGeometry(polyData)
+
+    regions = list()
+    for seed in seeds:
+        ids = numpyToIdArray(np.array([seed]))
+        for distance in distances:
+            times, peak, region = measure(
+                lambda: neighborExpand(polyData, ids, distance), repeat)
+            record(results, 'neighborExpand', polyData, {
+                'seed': seed,
+                'distance': distance
+            }, times, peak, region.GetNumberOfValues())
+
+            for angle in angles:
+                times, peak, region = measure(
+                    lambda: multiThresholdExpand(polyData, ids, distance,
+                                                 angle), repeat)
+                record(results, 'multiThresholdExpand', polyData, {
+                    'seed': seed,
+                    'distance': distance,
+                    'angle': angle
+                }, times, peak, region.GetNumberOfValues())
+                regions.append((ids, region))
+
+        for threshold in thresholds:
+            times, peak, region = measure(
+                lambda: angleExpand(polyData, ids, threshold), repeat)
+            record(results, 'angleExpand', polyData, {
+                'seed': seed,
+                'threshold': threshold
+            }, times, peak, region.GetNumberOfValues())
+
+    # Set operations and cleaning on the largest region grown
+    ids, selected = max(regions, key=lambda r: r[1].GetNumberOfValues())
+    other = regions[0][1]
+    cells = selected.GetNumberOfValues() + other.GetNumberOfValues()
+    for name, function in (('addSelection', addSelection),
+                           ('minusSelection', minusSelection)):
+        times, peak, _ = measure(lambda: function(selected, other), repeat)
+        record(results, name, polyData, {}, times, peak, cells)
+    times, peak, _ = measure(lambda: inverseSelection(polyData, selected),
+                             repeat)
+    record(results, 'inverseSelection', polyData, {}, times, peak,
+           numberOfCells)
+    times, peak, region = measure(
+        lambda: onSelectedExpand(polyData, ids, selected), repeat)
+    record(results, 'onSelectedExpand', polyData, {}, times, peak,
+           region.GetNumberOfValues())
+
+    # Export path
+    mask = np.zeros(numberOfCells, dtype=bool)
+    mask[np.random.default_rng(0).random(numberOfCells) < 0.5] = True
+    filename = os.path.join(directory, 'benchmark.vtp')
+    times, peak, _ = measure(
+        lambda: writeVTP(labelPolyData(polyData, mask), filename), repeat)
+    record(results, 'export', polyData, {}, times, peak, numberOfCells)
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'vtk': vtk.vtkVersion.GetVTKVersion(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpuCount': os.cpu_count(),
+        'memorySource': memorySource(),
+    }
+
+
+def compare(basePath, newPath):
+    """Print the time ratio of each benchmark entry between two runs."""
+    with open(basePath) as f:
+        base = json.load(f)
+    with open(newPath) as f:
+        new = json.load(f)
+
+    def key(entry):
+        return (entry['name'], entry['meshCells'],
+                json.dumps(entry['params'], sort_keys=True))
+
+    baseEntries = {key(entry): entry for entry in base['results']}
+    print('{:<22} {:>9} {:<34} {:>10} {:>10} {:>7}'.format(
+        'name', 'cells', 'params', 'base', 'new', 'ratio'))
+    for entry in new['results']:
+        old = baseEntries.get(key(entry))
+        if old is None:
+            continue
+        print('{:<22} {:>9} {:<34} {:>9.4f}s {:>9.4f}s {:>6.2f}x'.format(
+            entry['name'], entry['meshCells'], key(entry)[2], old['time'],
+            entry['time'], old['time'] / max(entry['time'], 1e-12)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the algorithm module.')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='targeted number of triangles of the meshes')
+    parser.add_argument('--seeds', type=int, default=3,
+                        help='number of random seed cells per mesh')
+    parser.add_argument('--distances', type=int, nargs='+',
+                        default=DEFAULT_DISTANCES)
+    parser.add_argument('--angles', type=float, nargs='+',
+                        default=DEFAULT_ANGLES)
+    parser.add_argument('--thresholds', type=float, nargs='+',
+                        default=DEFAULT_THRESHOLDS,
+                        help='normal thresholds of angleExpand')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='compare two result files instead')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    rng = np.random.default_rng(0)
+    results = list()
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            polyData = sphereMesh(size)
+            seeds = rng.integers(0, polyData.GetNumberOfCells(),
+                                 args.seeds).tolist()
+            benchmarkMesh(results, polyData, seeds, args.distances,
+                          args.angles, args.thresholds, args.repeat,
+                          directory)
+
+    report = {
+        'meta': metadata(),
+        'maxRss': maxRss(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
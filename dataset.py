@@ -0,0 +1,352 @@
+"""Packed export of a labeled dataset for training.
+
+All the labeled meshes of a dataset are concatenated into one store, a
+directory of raw arrays:
+
+    points.f32       (P, 3) float32 coordinates of the points of all cases
+    faces.i32        (F, 3) int32 triangles, numbered within their case
+    cellLabels.u8    (F,) uint8 label of each triangle
+    pointLabels.u8   (P,) uint8 label of each point
+    index.npz        case names, mesh hashes and the point and face offsets
+                     of each case
+
+`PackedDataset` memory-maps the arrays and gives any case as zero-copy
+slices, so that the data loader workers of a training job read cases at
+random without parsing any mesh.
+
+Labeled meshes are VTP or legacy VTK files written by the viewer, or STL
+files next to a label file (`.npz`) of the same name.
+
+Usage:
+    python dataset.py DATASET_DIR -o DATASET.pack -j 8
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from vtkio import (asLabels, meshHash, pointLabelsFromCells, readLabels,
+                   readSTLFast)
+
+# Version of the store layout
+PACK_VERSION = 1
+
+# Raw array files of a store: file suffix, dtype and number of columns
+PACK_ARRAYS = {
+    'points': ('.f32', np.float32, 3),
+    'faces': ('.i32', np.int32, 3),
+    'cellLabels': ('.u8', np.uint8, None),
+    'pointLabels': ('.u8', np.uint8, None),
+}
+
+
+def readLabeledMesh(path):
+    """Read a labeled mesh.
+
+    Args:
+        path (str): VTP or legacy VTK file with cell labels as scalars, or
+            STL file next to its label file.
+
+    Returns:
+        tuple: mesh and its cell and point labels.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.stl':
+        polyData = readSTLFast(path)
+        cellLabels, pointLabels = readLabels(
+            os.path.splitext(path)[0] + '.npz', polyData)
+        return polyData, cellLabels, pointLabels
+
+    if extension == '.vtp':
+        reader = vtk.vtkXMLPolyDataReader()
+    elif extension == '.vtk':
+        reader = vtk.vtkPolyDataReader()
+    else:
+        raise ValueError('Unsupported file: {}'.format(path))
+    reader.SetFileName(path)
+    reader.Update()
+    polyData = reader.GetOutput()
+
+    cellScalars = polyData.GetCellData().GetScalars()
+    if cellScalars is None:
+        raise ValueError('{} has no cell labels.'.format(path))
+    cellLabels = numpy_support.vtk_to_numpy(cellScalars)
+    pointScalars = polyData.GetPointData().GetScalars()
+    if pointScalars is None:
+        pointLabels = pointLabelsFromCells(polyData, cellLabels)
+    else:
+        pointLabels = numpy_support.vtk_to_numpy(pointScalars)
+    return polyData, cellLabels, pointLabels
+
+
+def packCase(path):
+    """Arrays of one labeled mesh in the layout of the store.
+
+    Meant to run in a worker process.
+
+    Args:
+        path (str): labeled mesh, see `readLabeledMesh`.
+
+    Returns:
+        dict: `points`, `faces`, `cellLabels`, `pointLabels` and `meshHash`.
+    """
+    polyData, cellLabels, pointLabels = readLabeledMesh(path)
+    polys = polyData.GetPolys()
+    if polys.GetNumberOfCells() != polyData.GetNumberOfCells() or np.any(
+            np.diff(numpy_support.vtk_to_numpy(polys.GetOffsetsArray())) != 3):
+        raise ValueError('{} is not a triangle mesh.'.format(path))
+
+    cellLabels = asLabels(cellLabels)
+    pointLabels = asLabels(pointLabels)
+    if cellLabels.dtype != np.uint8 or pointLabels.dtype != np.uint8:
+        raise ValueError('{} has labels over 255.'.format(path))
+
+    if polyData.GetNumberOfPoints() > 0:
+        points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+    else:
+        points = np.zeros((0, 3))
+    connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+    return {
+        'points': np.ascontiguousarray(points, dtype=np.float32),
+        'faces': connectivity.astype(np.int32).reshape(-1, 3),
+        'cellLabels': cellLabels,
+        'pointLabels': pointLabels,
+        'meshHash': meshHash(polyData),
+    }
+
+
+def _packJob(path):
+    try:
+        return path, packCase(path), None
+    except Exception as e:
+        return path, None, repr(e)
+
+
+def exportDataset(paths, output, jobs=None, names=None):
+    """Pack labeled meshes into a store.
+
+    Cases are read by a process pool and appended to the store in the order
+    of `paths`. The store is written next to `output` and moved over it once
+    complete.
+
+    Args:
+        paths (list): labeled meshes, see `readLabeledMesh`.
+        output (str): directory of the store.
+        jobs (int): number of worker processes, all CPUs if None.
+        names (list): name of each case, the file names by default.
+
+    Returns:
+        tuple: number of packed cases, and the error raised by each failed
+            file by path.
+    """
+    if names is None:
+        names = [os.path.basename(path) for path in paths]
+    temporary = output.rstrip(os.sep) + '.tmp'
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+
+    files = {
+        name: open(os.path.join(temporary, name + suffix), 'wb')
+        for name, (suffix, _, _) in PACK_ARRAYS.items()
+    }
+    packedNames = list()
+    hashes = list()
+    pointOffsets = [0]
+    faceOffsets = [0]
+    errors = dict()
+    try:
+        with multiprocessing.Pool(jobs) as pool:
+            for (path, case, error), name in zip(
+                    pool.imap(_packJob, paths), names):
+                if error is not None:
+                    errors[path] = error
+                    continue
+                for array, f in files.items():
+                    case[array].tofile(f)
+                packedNames.append(name)
+                hashes.append(case['meshHash'])
+                pointOffsets.append(pointOffsets[-1] +
+                                    case['points'].shape[0])
+                faceOffsets.append(faceOffsets[-1] + case['faces'].shape[0])
+    finally:
+        for f in files.values():
+            f.close()
+
+    np.savez(os.path.join(temporary, 'index.npz'),
+             version=PACK_VERSION,
+             names=np.array(packedNames, dtype=str),
+             meshHashes=np.array(hashes, dtype=str),
+             pointOffsets=np.array(pointOffsets, dtype=np.int64),
+             faceOffsets=np.array(faceOffsets, dtype=np.int64))
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.replace(temporary, output)
+    return len(packedNames), errors
+
+
+class PackedCase(object):
+    """One case of a store, as zero-copy slices of its arrays.
+
+    Attributes:
+        name (str): name of the case.
+        meshHash (str): content hash of the mesh, see `vtkio.meshHash`.
+        points (np.ndarray): (N, 3) float32 coordinates.
+        faces (np.ndarray): (M, 3) int32 triangles.
+        cellLabels (np.ndarray): (M,) uint8 label of each triangle.
+        pointLabels (np.ndarray): (N,) uint8 label of each point.
+    """
+
+    def __init__(self, name, meshHash, points, faces, cellLabels,
+                 pointLabels):
+        self.name = name
+        self.meshHash = meshHash
+        self.points = points
+        self.faces = faces
+        self.cellLabels = cellLabels
+        self.pointLabels = pointLabels
+
+    def toPolyData(self):
+        """Mesh of the case with its labels attached as scalars."""
+        points = vtk.vtkPoints()
+        points.SetData(
+            numpy_support.numpy_to_vtk(np.ascontiguousarray(self.points)))
+        connectivity = self.faces.astype(np.int64).ravel()
+        offsets = np.arange(0, connectivity.shape[0] + 1, 3, dtype=np.int64)
+        polys = vtk.vtkCellArray()
+        polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets),
+                      numpy_support.numpy_to_vtkIdTypeArray(connectivity))
+
+        polyData = vtk.vtkPolyData()
+        polyData.SetPoints(points)
+        polyData.SetPolys(polys)
+        polyData.GetCellData().SetScalars(
+            numpy_support.numpy_to_vtk(np.array(self.cellLabels)))
+        polyData.GetPointData().SetScalars(
+            numpy_support.numpy_to_vtk(np.array(self.pointLabels)))
+        return polyData
+
+
+class PackedDataset(object):
+    """Random access reader of a store written by `exportDataset`.
+
+    The arrays are memory-mapped on first access in each process, so that
+    the reader can be handed to data loader workers before any case is
+    read.
+
+    Args:
+        path (str): directory of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, 'index.npz')) as index:
+            if int(index['version']) != PACK_VERSION:
+                raise ValueError(
+                    '{} has an unsupported version.'.format(path))
+            self.names = index['names'].tolist()
+            self.meshHashes = index['meshHashes'].tolist()
+            self.pointOffsets = index['pointOffsets']
+            self.faceOffsets = index['faceOffsets']
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        """Case `i`, negative indices count from the end."""
+        if not -len(self) <= i < len(self):
+            raise IndexError('Case {} out of range.'.format(i))
+        i = i % len(self)
+        arrays = self.arrays()
+        points = slice(self.pointOffsets[i], self.pointOffsets[i + 1])
+        faces = slice(self.faceOffsets[i], self.faceOffsets[i + 1])
+        return PackedCase(self.names[i], self.meshHashes[i],
+                          arrays['points'][points], arrays['faces'][faces],
+                          arrays['cellLabels'][faces],
+                          arrays['pointLabels'][points])
+
+    def case(self, name):
+        """Case of a given name."""
+        return self[self.names.index(name)]
+
+    def arrays(self):
+        """Memory-mapped arrays of all cases, by name."""
+        if self._arrays is None:
+            sizes = {
+                'points': int(self.pointOffsets[-1]),
+                'faces': int(self.faceOffsets[-1]),
+                'cellLabels': int(self.faceOffsets[-1]),
+                'pointLabels': int(self.pointOffsets[-1]),
+            }
+            arrays = dict()
+            for name, (suffix, dtype, columns) in PACK_ARRAYS.items():
+                shape = (sizes[name], ) if columns is None else (sizes[name],
+                                                                 columns)
+                if sizes[name] == 0:
+                    # Empty files cannot be mapped
+                    arrays[name] = np.zeros(shape, dtype=dtype)
+                    continue
+                arrays[name] = np.memmap(os.path.join(self.path,
+                                                      name + suffix),
+                                         dtype=dtype,
+                                         mode='r',
+                                         shape=shape)
+            self._arrays = arrays
+        return self._arrays
+
+
+def findLabeledMeshes(directory):
+    """Labeled meshes of a directory, walked recursively.
+
+    STL files are only kept when their label file exists.
+    """
+    paths = list()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            extension = extension.lower()
+            if extension in ('.vtp', '.vtk') or (
+                    extension == '.stl' and
+                    os.path.exists(os.path.join(root, stem + '.npz'))):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Pack a labeled dataset into one memory-mapped store.')
+    parser.add_argument('input', help='dataset directory, walked recursively')
+    parser.add_argument('-o', '--output', required=True,
+                        help='directory of the store')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    args = parser.parse_args(argv)
+
+    paths = findLabeledMeshes(args.input)
+    names = [os.path.relpath(path, args.input) for path in paths]
+    start = time.perf_counter()
+    packed, errors = exportDataset(paths, args.output, args.jobs, names)
+    for path, error in sorted(errors.items()):
+        print('{}: FAILED {}'.format(path, error))
+
+    dataset = PackedDataset(args.output)
+    print('{} cases, {} points, {} faces in {:.1f}s, {} failed'.format(
+        packed, int(dataset.pointOffsets[-1]), int(dataset.faceOffsets[-1]),
+        time.perf_counter() - start, len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Offline cache of the per-mesh features of a dataset.
+
+Cell normals, centroids, areas, curvatures, the cell adjacency and the
+centroid graph of every mesh of a dataset are computed once by a process
+pool and stored in a cache directory, one uncompressed `.npz` file per mesh
+named by the content hash of the mesh and the version of the features. The
+viewer memory-maps the file of a mesh on load instead of recomputing its
+features. The least recently used files are evicted when the directory
+grows over its size cap.
+
+Usage:
+    python featurecache.py DATASET_DIR -j 8 --max-size 4096
+"""
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+from algorithm import cacheGeometry
+from meshcache import MeshCache, getMeshCache, setMeshCache
+from vtkio import meshHash, readSTLFast
+
+# Version of the cached features, bumped when they change
+FEATURE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'VTKLABEL_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'vtkLabelTool'))
+
+# Size cap of the cache directory in bytes
+DEFAULT_MAX_SIZE = 4 * 1024**3
+
+
+def featureFilename(cacheDir, digest, version=FEATURE_VERSION):
+    """Feature file of the mesh of content hash `digest`."""
+    return os.path.join(cacheDir, '{}.v{}.npz'.format(digest, version))
+
+
+def saveFeatures(polyData, digest, cacheDir=DEFAULT_CACHE_DIR):
+    """Compute the features of a mesh and write them to the cache.
+
+    Args:
+        polyData (vtkPolyData): mesh made of polys.
+        digest (str): content hash of the mesh, see `vtkio.meshHash`.
+        cacheDir (str): cache directory.
+
+    Returns:
+        str: written feature file.
+    """
+    cacheGeometry(polyData)
+    arrays = getMeshCache(polyData).toArrays()
+    arrays['version'] = np.array(FEATURE_VERSION)
+    arrays['meshHash'] = np.array(digest)
+
+    os.makedirs(cacheDir, exist_ok=True)
+    filename = featureFilename(cacheDir, digest)
+    # Uncompressed so that the arrays can be memory-mapped
+    temporary = '{}.{}.tmp.npz'.format(filename, os.getpid())
+    np.savez(temporary, **arrays)
+    os.replace(temporary, filename)
+    return filename
+
+
+def loadFeatures(polyData, digest, cacheDir=DEFAULT_CACHE_DIR):
+    """Fill the geometry cache of a mesh from its feature file, if cached.
+
+    Args:
+        polyData (vtkPolyData): mesh made of polys.
+        digest (str): content hash of the mesh, see `vtkio.meshHash`.
+        cacheDir (str): cache directory.
+
+    Returns:
+        bool: whether the features were found.
+    """
+    filename = featureFilename(cacheDir, digest)
+    try:
+        arrays = mmapNpz(filename)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return False
+    if int(arrays['version']) != FEATURE_VERSION or str(
+            arrays['meshHash']) != digest:
+        return False
+
+    try:
+        cache = MeshCache.fromArrays(polyData, arrays)
+    except ValueError:
+        return False
+    setMeshCache(polyData, cache)
+    # Mark as recently used for the eviction
+    os.utime(filename)
+    return True
+
+
+def mmapNpz(filename):
+    """Memory-map the arrays of an uncompressed .npz file.
+
+    `np.load` reads the members of a .npz file into memory; the members of
+    an uncompressed archive are contiguous in the file, so each one is
+    mapped at the offset of its data instead.
+
+    Args:
+        filename (str): .npz file written by `np.savez`.
+
+    Returns:
+        dict: read-only arrays by name.
+    """
+    arrays = dict()
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('{} is compressed.'.format(filename))
+            # Local file header, its name and extra field lengths may differ
+            # from the central directory ones
+            f.seek(info.header_offset)
+            nameLength, extraLength = struct.unpack('<HH', f.read(30)[26:])
+            f.seek(info.header_offset + 30 + nameLength + extraLength)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortranOrder, dtype = header
+
+            name = os.path.splitext(info.filename)[0]
+            size = int(np.prod(shape))
+            if size == 0 or shape == ():
+                # Nothing worth mapping
+                data = np.fromfile(f, dtype=dtype, count=size)
+                arrays[name] = data.reshape(shape)
+            else:
+                arrays[name] = np.memmap(filename,
+                                         dtype=dtype,
+                                         mode='r',
+                                         offset=f.tell(),
+                                         shape=shape,
+                                         order='F' if fortranOrder else 'C')
+    return arrays
+
+
+def evict(cacheDir=DEFAULT_CACHE_DIR, maxSize=DEFAULT_MAX_SIZE):
+    """Delete feature files until the cache directory fits its size cap.
+
+    Files of other feature versions go first, then the least recently used.
+
+    Args:
+        cacheDir (str): cache directory.
+        maxSize (int): size cap in bytes.
+
+    Returns:
+        int: number of deleted files.
+    """
+    files = _cacheFiles(cacheDir)
+    size = sum(file[2] for file in files)
+    deleted = 0
+    for _, _, fileSize, path in sorted(files):
+        if size <= maxSize:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        size -= fileSize
+        deleted += 1
+    return deleted
+
+
+def cacheSize(cacheDir=DEFAULT_CACHE_DIR):
+    """Size in bytes of the feature files of a cache directory."""
+    return sum(file[2] for file in _cacheFiles(cacheDir))
+
+
+def _cacheFiles(cacheDir):
+    """(current version, mtime, size, path) of each feature file."""
+    suffix = '.v{}.npz'.format(FEATURE_VERSION)
+    files = list()
+    for entry in os.scandir(cacheDir):
+        if entry.is_file() and entry.name.endswith('.npz') and \
+                '.tmp.' not in entry.name:
+            stat = entry.stat()
+            files.append((entry.name.endswith(suffix), stat.st_mtime,
+                          stat.st_size, entry.path))
+    return files
+
+
+def cacheFile(job):
+    """Cache the features of one STL file, meant to run in a worker process.
+
+    Args:
+        job (tuple): (STL path, cache directory).
+
+    Returns:
+        dict: file name, mesh hash, whether it was already cached, size of
+            the written feature file and time in seconds, or the error
+            raised.
+    """
+    path, cacheDir = job
+    report = {'file': path}
+    try:
+        start = time.perf_counter()
+        polyData = readSTLFast(path)
+        report['hash'] = meshHash(polyData)
+        report['cached'] = os.path.exists(
+            featureFilename(cacheDir, report['hash']))
+        if not report['cached']:
+            report['size'] = os.path.getsize(
+                saveFeatures(polyData, report['hash'], cacheDir))
+        report['time'] = time.perf_counter() - start
+    except Exception as e:
+        report['error'] = repr(e)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Cache the features of a dataset of STL files.')
+    parser.add_argument('input', help='dataset directory, walked recursively')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='cache directory (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--max-size', type=int,
+                        default=DEFAULT_MAX_SIZE // 1024**2,
+                        help='size cap of the cache directory in MB')
+    args = parser.parse_args(argv)
+
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(args.input) for name in names
+        if name.lower().endswith('.stl'))
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    # The cap is kept as files are written, not only at the end of a run
+    # that may write far more than it
+    maxSize = args.max_size * 1024**2
+    size = cacheSize(args.cache_dir)
+    deleted = 0
+    reports = list()
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.jobs) as pool:
+        for report in pool.imap_unordered(cacheFile,
+                                          [(path, args.cache_dir)
+                                           for path in paths]):
+            reports.append(report)
+            if 'error' in report:
+                print('{file}: FAILED {error}'.format(**report))
+            else:
+                print('{file}: {state} in {time:.3f}s'.format(
+                    state='cached' if report['cached'] else 'computed',
+                    **report))
+                size += report.get('size', 0)
+                if size > maxSize:
+                    deleted += evict(args.cache_dir, maxSize)
+                    size = cacheSize(args.cache_dir)
+    deleted += evict(args.cache_dir, maxSize)
+
+    failed = sum('error' in report for report in reports)
+    print('{} files in {:.1f}s, {} failed, {} evicted'.format(
+        len(reports),
+        time.perf_counter() - start, failed, deleted))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,25 +7,55 @@ from __future__ import print_function
 import vtk
 import ipdb
 
+from profiling import tracer
+
 
 
 class MouseInteractorPickCell(vtk.vtkInteractorStyleTrackballCamera):
+    """Cell picking style of the viewer.
+
+    A click picks a cell. When the `areaMode` of the viewer is 'RECT' or
+    'LASSO', dragging draws a screen region instead, whose cells are
+    selected on release.
+    """
+
     def __init__(self, polyData, viewer):
         self.AddObserver("LeftButtonPressEvent", self.leftButtonPressEvent)
+        self.AddObserver("LeftButtonReleaseEvent",
+                         self.leftButtonReleaseEvent)
+        self.AddObserver("MouseMoveEvent", self.mouseMoveEvent)
         self.AddObserver("KeyPressEvent", self.KeyPressEvent)
         self.polyData = polyData
         self.viewer = viewer
 
+        # Screen region being drawn, in display coordinates
+        self.region = None
+        self.regionPoints = vtk.vtkPoints()
+        self.regionLines = vtk.vtkCellArray()
+        regionPolyData = vtk.vtkPolyData()
+        regionPolyData.SetPoints(self.regionPoints)
+        regionPolyData.SetLines(self.regionLines)
+        regionMapper = vtk.vtkPolyDataMapper2D()
+        regionMapper.SetInputData(regionPolyData)
+        self.regionActor = vtk.vtkActor2D()
+        self.regionActor.SetMapper(regionMapper)
+        self.regionActor.GetProperty().SetColor(1, 0.6, 0)
+        self.regionActor.GetProperty().SetLineWidth(2)
+        self.regionActor.VisibilityOff()
+
     def leftButtonPressEvent(self, obj, event):
         clickPos = self.GetInteractor().GetEventPosition()
 
-        picker = vtk.vtkCellPicker()
-        picker.SetTolerance(0.0005)
-        picker.Pick(clickPos[0], clickPos[1], 0, self.GetDefaultRenderer())
+        if self.viewer.areaMode is not None:
+            self.region = [clickPos]
+            renderer = self.GetDefaultRenderer()
+            if not renderer.HasViewProp(self.regionActor):
+                renderer.AddViewProp(self.regionActor)
+            return
+
+        with tracer.span('pick'):
+            cellId = self.viewer.pickCell(clickPos[0], clickPos[1])
 
-        # Get the cell
-        cellId = picker.GetCellId()
-        
         if (cellId != -1):
             ids = vtk.vtkIdTypeArray()
             ids.SetNumberOfComponents(1)
@@ -35,13 +65,68 @@ class MouseInteractorPickCell(vtk.vtkInteractorStyleTrackballCamera):
 
         self.OnLeftButtonDown()
 
+    def mouseMoveEvent(self, obj, event):
+        if self.region is None:
+            self.OnMouseMove()
+            return
+
+        position = self.GetInteractor().GetEventPosition()
+        if self.viewer.areaMode == 'LASSO':
+            self.region.append(position)
+        else:
+            self.region = [self.region[0], position]
+        self.drawRegion()
+
+    def leftButtonReleaseEvent(self, obj, event):
+        if self.region is None:
+            self.OnLeftButtonUp()
+            return
+
+        polygon = self.regionPolygon()
+        self.region = None
+        self.regionActor.VisibilityOff()
+        if len(polygon) >= 3:
+            self.viewer.selectArea(polygon)
+        else:
+            self.GetInteractor().GetRenderWindow().Render()
+
+    def regionPolygon(self):
+        """Vertices of the region drawn, corners of a rectangle."""
+        if self.viewer.areaMode == 'LASSO':
+            return self.region
+        if len(self.region) < 2:
+            return list()
+        (x0, y0), (x1, y1) = self.region
+        if x0 == x1 or y0 == y1:
+            return list()
+        return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+    def drawRegion(self):
+        polygon = self.regionPolygon()
+        self.regionPoints.Reset()
+        self.regionLines.Reset()
+        if len(polygon) >= 2:
+            for x, y in polygon:
+                self.regionPoints.InsertNextPoint(x, y, 0)
+            self.regionLines.InsertNextCell(len(polygon) + 1)
+            for i in list(range(len(polygon))) + [0]:
+                self.regionLines.InsertCellPoint(i)
+        self.regionPoints.Modified()
+        self.regionLines.Modified()
+        self.regionActor.VisibilityOn()
+        self.GetInteractor().GetRenderWindow().Render()
+
     def KeyPressEvent(self, obj, event):
         control = self.GetInteractor().GetControlKey()
         key = self.GetInteractor().GetKeySym()
         if control and key == "z":
-            if len(self.viewer.selected_ids_list) > 0:
-                self.viewer.selected_ids = self.viewer.selected_ids_list.pop()
-                self.viewer.highlight()
+            self.viewer.undo()
+        elif control and key == "y":
+            self.viewer.redo()
+        elif key == "Escape":
+            self.viewer.cancelExpansion()
+        elif key == "Return":
+            self.viewer.acceptExpansion()
         return
         
 
@@ -0,0 +1,153 @@
+"""Undo/redo history of a cell selection.
+
+Each step is stored as the cell ids it added and removed rather than as a
+full copy of the selection, and the oldest steps are dropped once the
+history grows over a memory budget.
+"""
+import numpy as np
+
+from selection import Selection
+
+
+class SelectionHistory(object):
+    """Undo/redo stacks of selection changes.
+
+    Args:
+        memoryBudget (int): largest number of bytes held by the stored
+            steps, the oldest steps are dropped beyond it.
+    """
+
+    def __init__(self, memoryBudget=64 * 1024 * 1024):
+        self.memoryBudget = memoryBudget
+        self.undoSteps = list()
+        self.redoSteps = list()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.undoSteps)
+
+    def canUndo(self):
+        return len(self.undoSteps) > 0
+
+    def canRedo(self):
+        return len(self.redoSteps) > 0
+
+    def copy(self):
+        """Copy of the history, sharing the (never modified) steps."""
+        history = SelectionHistory(self.memoryBudget)
+        history.undoSteps = list(self.undoSteps)
+        history.redoSteps = list(self.redoSteps)
+        history.nbytes = self.nbytes
+        return history
+
+    def clear(self):
+        self.undoSteps = list()
+        self.redoSteps = list()
+        self.nbytes = 0
+
+    def toArrays(self):
+        """Steps of the history as flat arrays, see `fromArrays`.
+
+        Returns:
+            dict: for the undo and redo stacks, the (added, removed) sizes of
+                each step and the concatenated cell ids of the steps.
+        """
+        arrays = dict()
+        for name, steps in (('undo', self.undoSteps), ('redo',
+                                                       self.redoSteps)):
+            arrays[name + 'Sizes'] = np.array(
+                [(added.shape[0], removed.shape[0])
+                 for added, removed in steps],
+                dtype=np.int64).reshape(-1, 2)
+            arrays[name + 'Ids'] = np.concatenate(
+                [ids for step in steps for ids in step] +
+                [np.empty(0, dtype=np.uint32)])
+        return arrays
+
+    @classmethod
+    def fromArrays(cls, arrays, memoryBudget=64 * 1024 * 1024):
+        """Rebuild a history from the arrays of `toArrays`."""
+        history = cls(memoryBudget)
+        for name, steps in (('undo', history.undoSteps),
+                            ('redo', history.redoSteps)):
+            ids = arrays[name + 'Ids']
+            bounds = np.concatenate([[0], np.cumsum(arrays[name + 'Sizes'])])
+            for i in range(0, bounds.shape[0] - 1, 2):
+                history._push(steps, (ids[bounds[i]:bounds[i + 1]],
+                                      ids[bounds[i + 1]:bounds[i + 2]]))
+        return history
+
+    def record(self, before, after):
+        """Record the change from one selection to another.
+
+        Steps changing nothing are not recorded. Recording a step clears the
+        redo stack.
+
+        Args:
+            before (Selection): selection before the change.
+            after (Selection): selection after the change.
+        """
+        changed = before.mask ^ after.mask
+        if not changed.any():
+            return
+
+        dtype = np.uint32 if after.numberOfCells < 2**32 else np.int64
+        added = np.flatnonzero(changed & after.mask).astype(dtype)
+        removed = np.flatnonzero(changed & before.mask).astype(dtype)
+
+        self._drop(self.redoSteps)
+        self._push(self.undoSteps, (added, removed))
+        while self.nbytes > self.memoryBudget and len(self.undoSteps) > 1:
+            self._pop(self.undoSteps, 0)
+
+    def undo(self, current):
+        """Revert the last recorded step.
+
+        Args:
+            current (Selection): current selection.
+
+        Returns:
+            Selection: selection before the step, None if there is nothing to
+                undo.
+        """
+        if not self.canUndo():
+            return None
+        added, removed = self._pop(self.undoSteps)
+        self._push(self.redoSteps, (added, removed))
+        return self._apply(current, removed, added)
+
+    def redo(self, current):
+        """Replay the last undone step.
+
+        Args:
+            current (Selection): current selection.
+
+        Returns:
+            Selection: selection after the step, None if there is nothing to
+                redo.
+        """
+        if not self.canRedo():
+            return None
+        added, removed = self._pop(self.redoSteps)
+        self._push(self.undoSteps, (added, removed))
+        return self._apply(current, added, removed)
+
+    @staticmethod
+    def _apply(current, added, removed):
+        mask = current.mask.copy()
+        mask[added] = True
+        mask[removed] = False
+        return Selection(current.numberOfCells, mask)
+
+    def _push(self, steps, step):
+        steps.append(step)
+        self.nbytes += step[0].nbytes + step[1].nbytes
+
+    def _pop(self, steps, index=-1):
+        step = steps.pop(index)
+        self.nbytes -= step[0].nbytes + step[1].nbytes
+        return step
+
+    def _drop(self, steps):
+        while steps:
+            self._pop(steps)
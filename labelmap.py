@@ -0,0 +1,91 @@
+"""Multi-class cell labels of a mesh.
+
+All classes live in a single per-cell label array, 0 meaning unlabeled. The
+array is uint8 and promoted to uint16 once a class above 255 is used. Each
+class is edited as a `Selection`, with vectorized mask operations on the
+label array.
+"""
+import numpy as np
+
+from selection import Selection
+
+# Label of the unlabeled cells
+UNLABELED = 0
+
+
+def labelDtype(label):
+    """Smallest label dtype holding `label`."""
+    if label <= np.iinfo(np.uint8).max:
+        return np.dtype(np.uint8)
+    if label <= np.iinfo(np.uint16).max:
+        return np.dtype(np.uint16)
+    raise ValueError('Label out of range: {}'.format(label))
+
+
+class LabelMap(object):
+    """Class of each cell of a mesh.
+
+    Args:
+        numberOfCells (int): number of cells of the mesh.
+        labels (np.ndarray): uint8 or uint16 class of each cell, None for an
+            unlabeled mesh. The array is used as is, not copied.
+    """
+
+    def __init__(self, numberOfCells, labels=None):
+        if labels is None:
+            labels = np.zeros(numberOfCells, dtype=np.uint8)
+        elif labels.shape != (numberOfCells, ) or labels.dtype not in (
+                np.uint8, np.uint16):
+            raise ValueError(
+                'labels must be a uint8 or uint16 array of {} cells.'.format(
+                    numberOfCells))
+        self.labels = labels
+
+    @property
+    def numberOfCells(self):
+        return self.labels.shape[0]
+
+    def copy(self):
+        return LabelMap(self.numberOfCells, self.labels.copy())
+
+    def classes(self):
+        """Sorted classes of the labeled cells."""
+        counts = self.counts()
+        return np.flatnonzero(counts[1:]) + 1
+
+    def counts(self):
+        """Number of cells of each label, unlabeled cells included."""
+        return np.bincount(self.labels, minlength=1)
+
+    def selection(self, label):
+        """Cells of a class as a Selection."""
+        return Selection(self.numberOfCells, self.labels == label)
+
+    def available(self, label):
+        """Bool mask of the cells a class may take: its own and unlabeled."""
+        return (self.labels == UNLABELED) | (self.labels == label)
+
+    def assign(self, label, selection):
+        """Set the cells of a class.
+
+        Cells of the class missing from `selection` are unlabeled, cells of
+        `selection` belonging to another class are left to it.
+
+        Args:
+            label (int): class, above 0.
+            selection (Selection): cells of the class.
+
+        Returns:
+            Selection: cells of the class after the assignment.
+        """
+        if label <= UNLABELED:
+            raise ValueError('Label out of range: {}'.format(label))
+        dtype = labelDtype(label)
+        if dtype.itemsize > self.labels.dtype.itemsize:
+            self.labels = self.labels.astype(dtype)
+
+        current = self.labels == label
+        mask = selection.mask & (current | (self.labels == UNLABELED))
+        self.labels[current & ~mask] = UNLABELED
+        self.labels[mask & ~current] = label
+        return Selection(self.numberOfCells, mask)
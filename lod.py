@@ -0,0 +1,120 @@
+"""Level of detail of large meshes.
+
+Very large meshes are rendered and picked on a decimated proxy mesh, while
+labeling keeps running on the full resolution mesh. Cells are mapped
+between both meshes by nearest cell centroid.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from algorithm import getCellAreas, getCellCentroids
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+def decimate(polyData, targetCells):
+    """Decimate a mesh to about `targetCells` triangles by vertex clustering.
+
+    Clustering is used over quadric edge collapse as it runs in a fraction
+    of a second on millions of cells.
+
+    Args:
+        polyData (vtkPolyData): mesh to be decimated.
+        targetCells (int): targeted number of triangles.
+
+    Returns:
+        vtkPolyData: decimated mesh.
+    """
+    # A surface binned by cubes of side h has about 2 * area / h^2 triangles
+    area = getCellAreas(polyData).sum()
+    side = np.sqrt(2.0 * area / targetCells)
+    bounds = np.array(polyData.GetBounds()).reshape(3, 2)
+    divisions = np.maximum(np.ceil((bounds[:, 1] - bounds[:, 0]) / side), 1)
+
+    clustering = vtk.vtkQuadricClustering()
+    clustering.SetInputData(polyData)
+    clustering.AutoAdjustNumberOfDivisionsOff()
+    clustering.SetNumberOfDivisions(*divisions.astype(int).tolist())
+    clustering.Update()
+    return clustering.GetOutput()
+
+
+class NearestPoint(object):
+    """Nearest point queries over a point set.
+
+    Uses scipy's cKDTree when available and a vtkStaticPointLocator
+    otherwise.
+
+    Args:
+        points (np.ndarray): (N, 3) points.
+    """
+
+    def __init__(self, points):
+        if cKDTree is not None:
+            self.tree = cKDTree(points)
+            return
+        self.tree = None
+        pointSet = vtk.vtkPolyData()
+        vtkPoints = vtk.vtkPoints()
+        vtkPoints.SetData(
+            numpy_support.numpy_to_vtk(np.ascontiguousarray(points)))
+        pointSet.SetPoints(vtkPoints)
+        self.locator = vtk.vtkStaticPointLocator()
+        self.locator.SetDataSet(pointSet)
+        self.locator.BuildLocator()
+
+    def __call__(self, queries):
+        """Index of the nearest point of each of the (M, 3) `queries`."""
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+        if self.tree is not None:
+            return self.tree.query(queries, workers=-1)[1].astype(np.int64)
+        return np.array(
+            [self.locator.FindClosestPoint(query) for query in queries],
+            dtype=np.int64)
+
+
+class ProxyMesh(object):
+    """Decimated stand-in of a mesh for rendering and picking.
+
+    Args:
+        polyData (vtkPolyData): full resolution mesh.
+        targetCells (int): targeted number of triangles of the proxy.
+
+    Attributes:
+        polyData (vtkPolyData): proxy mesh.
+        proxyToOriginal (np.ndarray): original cell nearest to each proxy
+            cell, whose label the proxy cell shows.
+        originalToProxy (np.ndarray): proxy cell nearest to each original
+            cell.
+    """
+
+    def __init__(self, polyData, targetCells):
+        self.polyData = decimate(polyData, targetCells)
+        originalCentroids = getCellCentroids(polyData)
+        proxyCentroids = getCellCentroids(self.polyData)
+        self.nearestOriginal = NearestPoint(originalCentroids)
+        self.proxyToOriginal = self.nearestOriginal(proxyCentroids)
+        self.originalToProxy = NearestPoint(proxyCentroids)(originalCentroids)
+
+    def displayLabels(self, labels, ids):
+        """Per proxy cell labels of per original cell labels.
+
+        Args:
+            labels (np.ndarray): label of each original cell.
+            ids (np.ndarray): original cells always shown, such as picked
+                cells too small to be any proxy cell's nearest cell.
+
+        Returns:
+            np.ndarray: label of each proxy cell.
+        """
+        proxyLabels = labels[self.proxyToOriginal]
+        proxyLabels[self.originalToProxy[ids]] = labels[ids]
+        return proxyLabels
+
+    def originalCell(self, position):
+        """Original cell nearest to a position picked on the proxy."""
+        return int(self.nearestOriginal(position)[0])
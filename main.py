@@ -5,25 +5,65 @@ Mainframe for vtk-labeling based on PyQt, vtk.
 """
 import os
 import sys
+import threading
+import time
+import traceback
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 import ipdb
 import numpy as np
 import vtk
 from vtk.util import numpy_support
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import (QApplication, QButtonGroup, QDesktopWidget,
-                             QFileDialog, QFrame, QHBoxLayout, QLabel,
-                             QLineEdit, QMainWindow, QPushButton, QRadioButton,
-                             QSlider, QVBoxLayout, QWidget)
+                             QDoubleSpinBox, QFileDialog, QFrame, QHBoxLayout, QLabel,
+                             QLineEdit, QMainWindow, QMessageBox, QPushButton,
+                             QRadioButton, QSlider, QSpinBox, QVBoxLayout,
+                             QWidget)
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 
-from algorithm import (addSelection, inverseSelection, minusSelection,
-                       multiThresholdExpand, onSelectedExpand)
+from algorithm import (cacheGeometry, cleanSelection, closeSelection,
+                       curvatureExpandRings, dilateSelection, erodeSelection,
+                       geodesicExpandRings, multiThresholdExpandRings,
+                       openSelection)
+from dataset import readLabeledMesh
+from featurecache import loadFeatures
 from highlightCellPick import MouseInteractorPickCell
-from vtkio import readSTL, writeVTP
+from history import SelectionHistory
+from labelmap import LabelMap, UNLABELED
+from lod import ProxyMesh
+from picking import (CellPicker, buildCellLocator, frustumSelect,
+                     hardwareSelect)
+from profiling import tracer
+from selection import Selection
+from session import Autosaver, loadSession, sessionFilename
+from transfer import transferLabels
+from vtkio import (labelPolyData, meshHash, readSTLFast, writeLabels,
+                   writeVTP)
+
+
+HIGHLIGHT_NONE = 0
+HIGHLIGHT_SELECTED = 1
+HIGHLIGHT_PICKED = 2
+HIGHLIGHT_PREVIEW = 3
+# first highlight label of the other classes, colored from CLASS_COLORS
+HIGHLIGHT_CLASS = 4
+CLASS_COLORS = vtk.vtkColorSeries.BREWER_QUALITATIVE_SET3
 
 
 class ToothViewer(QFrame):
+    # emitted after a pick with the latency breakdown while tracing
+    latencyUpdated = pyqtSignal(str)
+    # emitted from the expansion worker with the result of a job
+    expansionFinished = pyqtSignal(object)
+    # emitted from the expansion worker with the cells grown since last frame
+    expansionProgress = pyqtSignal(object)
+    # emitted when an expansion starts or ends
+    busyChanged = pyqtSignal(bool)
+    # emitted from the autosave thread when a session could not be written
+    autosaveFailed = pyqtSignal(str)
+
     def __init__(self):
         super(ToothViewer, self).__init__()
 
@@ -39,19 +79,67 @@ class ToothViewer(QFrame):
         self.renderWindow.AddRenderer(self.renderer)
         self.interactor = interactor
 
-        self.initializeWithSphere()
-
-        # Selected Mapper and Actor
-        self.pickedMapper = vtk.vtkDataSetMapper()
-        self.pickedActor = vtk.vtkActor()
-        self.selectedMapper = vtk.vtkDataSetMapper()
-        self.selectedActor = vtk.vtkActor()
+        # Highlight colors, indexed by the per-cell highlight label
+        classColors = vtk.vtkColorSeries()
+        classColors.SetColorScheme(CLASS_COLORS)
+        numberOfColors = HIGHLIGHT_CLASS + classColors.GetNumberOfColors()
+        self.lookupTable = vtk.vtkLookupTable()
+        self.lookupTable.SetNumberOfTableValues(numberOfColors)
+        self.lookupTable.SetTableRange(0, numberOfColors - 1)
+        self.lookupTable.SetTableValue(HIGHLIGHT_NONE, 1, 1, 1, 1)
+        self.lookupTable.SetTableValue(HIGHLIGHT_SELECTED, 1, 0, 0, 1)
+        self.lookupTable.SetTableValue(HIGHLIGHT_PICKED, 0, 0, 1, 1)
+        self.lookupTable.SetTableValue(HIGHLIGHT_PREVIEW, 1, 0.6, 0, 1)
+        for i in range(classColors.GetNumberOfColors()):
+            color = classColors.GetColor(i)
+            self.lookupTable.SetTableValue(HIGHLIGHT_CLASS + i,
+                                           color[0] / 255.0,
+                                           color[1] / 255.0,
+                                           color[2] / 255.0, 1)
+        self.lookupTable.Build()
+        # Highlight label of the cells of each class, cycling the colors
+        self.classHighlight = (HIGHLIGHT_CLASS + np.arange(-1, 2**16 - 1) %
+                               classColors.GetNumberOfColors()).astype(
+                                   np.uint8)
+        self.classHighlight[UNLABELED] = HIGHLIGHT_NONE
 
         # selection Mode
         self.selectionMode = 'PIC'
-        self.selected_ids = vtk.vtkIdTypeArray()
-        self.selected_ids.SetNumberOfComponents(1)
-        self.selected_ids_list = list()
+        # class edited by the selection, all classes are kept in `labelMap`
+        self.activeClass = 1
+        # expansion by number of rings (NEIGHBOR), surface distance
+        # (GEODESIC, within `radius` mm) or up to high curvature boundaries
+        # (CURVATURE, up to `curvatureThreshold` 1/mm of mean curvature)
+        self.expansionMethod = 'NEIGHBOR'
+        self.radius = 2.0
+        self.curvatureThreshold = 1.0
+        # render and pick on a proxy of about `lodTargetCells` cells when
+        # the mesh is larger, labels stay on the full resolution mesh
+        self.levelOfDetail = False
+        self.lodTargetCells = 200000
+        self.proxy = None
+        # screen region selection ('RECT', 'LASSO' or None for clicks), by
+        # hardware selection unless disabled or unavailable
+        self.areaMode = None
+        self.hardwareSelection = True
+
+        # Expansion worker, only the job of the latest click is applied
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.generation = 0
+        self.cancelEvent = None
+        self.acceptEvent = None
+        self.previewBudget = 0.03
+        self.previewShown = False
+        self.expansionFinished.connect(self.finishUpdate)
+        self.expansionProgress.connect(self.previewExpansion)
+
+        # Session of the mesh, autosaved every `autosaver.interval`
+        # operations once `sessionFile` is set
+        self.sessionFile = None
+        self.meshHash = None
+        self.autosaver = Autosaver(onError=self.autosaveFailed.emit)
+
+        self.initializeWithSphere()
 
     def initializeWithSphere(self):
         # Create source
@@ -59,78 +147,424 @@ class ToothViewer(QFrame):
         source.SetCenter(0, 0, 0)
         source.SetRadius(5.0)
         source.Update()
-        self.polyData = source.GetOutput()
+
+        self.setPolyData(source.GetOutput())
+
+    def setPolyData(self, polyData):
+        """Show a new mesh, replacing the current one and its selection.
+
+        Args:
+            polyData (vtkPolyData): mesh to be labeled.
+        """
+        self.cancelExpansion()
+        self.polyData = polyData
+        self.sessionFile = None
+        self.meshHash = None
+        self.cellPicker = None
+        self.resetSelection()
+        self.buildDisplay()
+        self.renderer.ResetCamera()
+
+    def setLevelOfDetail(self, enabled):
+        """Switch rendering and picking to a decimated proxy of the mesh."""
+        self.cancelExpansion()
+        self.levelOfDetail = enabled
+        self.buildDisplay()
+        self.highlight()
+
+    def buildDisplay(self):
+        """Build the actor of the mesh, or of its proxy in LOD mode.
+
+        The mesh is drawn by a single actor colored through a per-cell
+        highlight label array, attached to a shallow copy of the mesh so that
+        the geometry is shared and the labels never reach `polyData`.
+        """
+        self.renderer.RemoveAllViewProps()
+        numberOfCells = self.polyData.GetNumberOfCells()
+        self.highlightLabels = np.zeros(numberOfCells, dtype=np.uint8)
+        if self.levelOfDetail and numberOfCells > self.lodTargetCells:
+            self.proxy = ProxyMesh(self.polyData, self.lodTargetCells)
+            displayMesh = self.proxy.polyData
+            self.displayLabels = np.zeros(displayMesh.GetNumberOfCells(),
+                                          dtype=np.uint8)
+        else:
+            self.proxy = None
+            displayMesh = self.polyData
+            self.displayLabels = self.highlightLabels
+        self.highlightArray = numpy_support.numpy_to_vtk(self.displayLabels)
+        self.highlightArray.SetName('Highlight')
+
+        display = vtk.vtkPolyData()
+        display.ShallowCopy(displayMesh)
+        display.GetCellData().AddArray(self.highlightArray)
+
+        # Screen picker of the displayed mesh, reused for every pick. The
+        # picker only uses a locator built on the very dataset of the actor.
+        displayLocator = buildCellLocator(display)
+        self.picker = vtk.vtkCellPicker()
+        self.picker.SetTolerance(0.0005)
+        self.picker.AddLocator(displayLocator)
+        # World space ray picker of `polyData`, sharing the locator when
+        # the mesh itself is displayed
+        if self.proxy is None:
+            self.cellPicker = CellPicker(self.polyData, displayLocator)
+        elif self.cellPicker is None or \
+                self.cellPicker.polyData is not self.polyData:
+            self.cellPicker = CellPicker(self.polyData)
 
         # Create a mapper
         mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputData(self.polyData)
+        mapper.SetInputData(display)
+        mapper.SetScalarModeToUseCellFieldData()
+        mapper.SelectColorArray('Highlight')
+        mapper.SetColorModeToMapScalars()
+        mapper.SetLookupTable(self.lookupTable)
+        mapper.UseLookupTableScalarRangeOn()
+        mapper.ScalarVisibilityOn()
 
         # Create an actor
-        actor = vtk.vtkActor()
-        actor.SetMapper(mapper)
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(mapper)
+
+        self.renderer.AddActor(self.actor)
+
+    def pickCell(self, x, y):
+        """Cell of `polyData` under a display position.
+
+        Args:
+            x (int): display x coordinate.
+            y (int): display y coordinate.
+
+        Returns:
+            int: picked cell, -1 if none.
+        """
+        self.picker.Pick(x, y, 0, self.renderer)
+        cellId = self.picker.GetCellId()
+        if cellId == -1:
+            return -1
+        return self.originalCell(cellId, self.picker.GetPickPosition())
+
+    def pickRay(self, origin, direction):
+        """Cell of `polyData` first hit by a world space ray, see
+        `picking.CellPicker.pickRay`."""
+        return self.cellPicker.pickRay(origin, direction)[0]
+
+    def originalCell(self, cellId, position):
+        """Cell of `polyData` of a cell picked at `position`."""
+        if self.proxy is None:
+            return cellId
+        return self.proxy.originalCell(position)
+
+    def resetSelection(self):
+        self.ids = vtk.vtkIdTypeArray()
+        self.labelMap = LabelMap(self.polyData.GetNumberOfCells())
+        self.selection = self.labelMap.selection(self.activeClass)
+        # undo/redo history of each class
+        self.histories = dict()
+        self.history = self.histories.setdefault(self.activeClass,
+                                                 SelectionHistory())
+
+    def setActiveClass(self, label):
+        """Switch the class edited by the selection.
+
+        Args:
+            label (int): class, above 0.
+        """
+        self.cancelExpansion()
+        self.activeClass = label
+        self.selection = self.labelMap.selection(label)
+        self.history = self.histories.setdefault(label, SelectionHistory())
+        self.highlight()
 
-        self.renderer.AddActor(actor)
-        self.renderer.ResetCamera()
+    def setSelection(self, selection):
+        self.cancelExpansion()
+        self.commitSelection(selection)
+
+    def commitSelection(self, selection, labels=None):
+        """Make `selection` the cells of the active class.
+
+        Cells of other classes are left to them.
+        """
+        before = self.selection
+        self.selection = self.labelMap.assign(self.activeClass, selection)
+        with tracer.span('history'):
+            self.history.record(before, self.selection)
+        self.highlight(labels)
+        self.countOperation()
+
+    def undo(self):
+        self.cancelExpansion()
+        selection = self.history.undo(self.selection)
+        if selection is not None:
+            self.selection = self.labelMap.assign(self.activeClass,
+                                                  selection)
+            self.highlight()
+            self.countOperation()
+
+    def redo(self):
+        self.cancelExpansion()
+        selection = self.history.redo(self.selection)
+        if selection is not None:
+            self.selection = self.labelMap.assign(self.activeClass,
+                                                  selection)
+            self.highlight()
+            self.countOperation()
+
+    def sessionState(self):
+        """Snapshot of the session, see `session.saveSession`."""
+        return {
+            'meshHash': self.meshHash,
+            'labels': self.labelMap.labels.copy(),
+            'activeClass': self.activeClass,
+            'histories': {
+                label: history.copy()
+                for label, history in self.histories.items()
+            },
+            'settings': {
+                'neighborThreshold': self.neighborThreshold,
+                'angleThreshold': self.angleThreshold,
+                'radius': self.radius,
+                'curvatureThreshold': self.curvatureThreshold,
+                'expansionMethod': self.expansionMethod,
+            },
+        }
+
+    def restoreSession(self, state):
+        """Restore the labels and histories of a session of the mesh.
+
+        Thresholds are left to the caller, as they belong to the panel.
+
+        Args:
+            state (dict): session read by `session.loadSession`.
+        """
+        self.cancelExpansion()
+        self.labelMap = LabelMap(self.polyData.GetNumberOfCells(),
+                                 state['labels'])
+        self.histories = state['histories']
+        self.setActiveClass(state['activeClass'])
+
+    def addLabels(self, labels):
+        """Label the unlabeled cells from a label array, such as transferred
+        labels.
+
+        Labeled cells keep their class. Each class gets one undo step.
+
+        Args:
+            labels (np.ndarray): label of each cell, 0 for none.
+        """
+        self.cancelExpansion()
+        for label in np.unique(labels[labels != UNLABELED]).tolist():
+            before = self.labelMap.selection(label)
+            after = self.labelMap.assign(
+                label, before | Selection(self.labelMap.numberOfCells,
+                                          labels == label))
+            self.histories.setdefault(label,
+                                      SelectionHistory()).record(before, after)
+        self.selection = self.labelMap.selection(self.activeClass)
+        self.highlight()
+        self.countOperation()
+
+    def countOperation(self):
+        """Count an operation, autosaving the session when due."""
+        if self.autosaver.count() and self.sessionFile is not None:
+            self.autosaver.save(self.sessionFile, self.sessionState())
+
+    def cancelExpansion(self):
+        """Cancel the in-flight expansion, its result will be dropped."""
+        self.generation += 1
+        if self.cancelEvent is not None:
+            self.cancelEvent.set()
+            self.cancelEvent = None
+            self.acceptEvent = None
+            self.busyChanged.emit(False)
+        if self.previewShown:
+            self.previewShown = False
+            self.highlight()
+
+    def acceptExpansion(self):
+        """Stop the in-flight expansion, keeping the region grown so far."""
+        if self.acceptEvent is not None:
+            self.acceptEvent.set()
 
     def update(self, ids):
+        """Apply a pick according to the selection mode.
+
+        The expansion and the highlight labels are computed on the worker
+        thread, superseding any in-flight job, and applied by `finishUpdate`
+        on the GUI thread. The region grown so far is previewed by
+        `previewExpansion` every `previewBudget` seconds.
+
+        Args:
+            ids (vtkIdTypeArray): picked cells.
+        """
+        start = time.perf_counter()
+        self.cancelExpansion()
         self.ids = ids
-
-        if len(self.selected_ids_list) <= 100:
-            self.selected_ids_list.append(self.selected_ids)
-        else:
-            self.selected_ids_list = self.selected_ids_list[1:]
-
-        if self.selectionMode == 'ADD':
-            self.selected_ids = addSelection(
-                self.selected_ids,
-                multiThresholdExpand(self.polyData, ids,
-                                     self.neighborThreshold,
-                                     self.angleThreshold))
-        elif self.selectionMode == 'SEL':
-            self.selected_ids = multiThresholdExpand(self.polyData, ids,
-                                                     self.neighborThreshold,
-                                                     self.angleThreshold)
-        elif self.selectionMode == 'DEL':
-            self.selected_ids = minusSelection(
-                self.selected_ids,
-                multiThresholdExpand(self.polyData, ids,
-                                     self.neighborThreshold,
-                                     self.angleThreshold))
+        # Show the pick right away
         self.highlight()
 
-    def highlight(self):
-
-        self.highlight_with_id(self.selected_ids, (1, 0, 0),
-                               self.selectedMapper, self.selectedActor)
-        self.highlight_with_id(self.ids, (0, 0, 1), self.pickedMapper,
-                               self.pickedActor)
-
-    def highlight_with_id(self, ids, color, mapper, actor):
-        selectionNode = vtk.vtkSelectionNode()
-        selectionNode.SetFieldType(vtk.vtkSelectionNode.CELL)
-        selectionNode.SetContentType(vtk.vtkSelectionNode.INDICES)
-        selectionNode.SetSelectionList(ids)
-
-        selection = vtk.vtkSelection()
-        selection.AddNode(selectionNode)
-
-        extractSelection = vtk.vtkExtractSelection()
-        extractSelection.SetInputData(0, self.polyData)
-        extractSelection.SetInputData(1, selection)
-        extractSelection.Update()
+        if self.selectionMode not in ('ADD', 'SEL', 'DEL'):
+            self.reportLatency(start)
+            return
 
-        selected = vtk.vtkUnstructuredGrid()
-        selected.ShallowCopy(extractSelection.GetOutput())
+        self.cancelEvent = threading.Event()
+        self.acceptEvent = threading.Event()
+        self.busyChanged.emit(True)
+        rings = self.expansionRings(ids)
+        self.executor.submit(self.runExpansion, self.generation,
+                             self.cancelEvent, self.acceptEvent, start,
+                             self.selectionMode, ids, rings, self.selection,
+                             self.activeClass)
+
+    def expansionRings(self, ids):
+        """Ring generator of the current expansion method."""
+        if self.expansionMethod == 'GEODESIC':
+            return geodesicExpandRings(self.polyData, ids, self.radius,
+                                       self.angleThreshold)
+        if self.expansionMethod == 'CURVATURE':
+            return curvatureExpandRings(self.polyData, ids,
+                                        self.curvatureThreshold)
+        return multiThresholdExpandRings(self.polyData, ids,
+                                         self.neighborThreshold,
+                                         self.angleThreshold)
+
+    def runExpansion(self, generation, cancelEvent, acceptEvent, start, mode,
+                     ids, rings, selection, label):
+        """Expansion job, run on the worker thread."""
+        try:
+            with tracer.span('expand'):
+                region = list()
+                pending = list()
+                lastFrame = time.perf_counter()
+                for ring in rings:
+                    if cancelEvent.is_set():
+                        return
+                    region.append(ring)
+                    pending.append(ring)
+                    if acceptEvent.is_set():
+                        break
+                    if time.perf_counter() - lastFrame > self.previewBudget:
+                        self.expansionProgress.emit(
+                            (generation, np.concatenate(pending)))
+                        pending = list()
+                        lastFrame = time.perf_counter()
+                expanded = Selection.fromIds(selection.numberOfCells,
+                                             np.concatenate(region))
+            with tracer.span('merge'):
+                selection = self.mergeSelection(mode, selection, expanded)
+                # Cells of other classes are left to them
+                selection = Selection(
+                    selection.numberOfCells,
+                    selection.mask & self.labelMap.available(label))
+            with tracer.span('labels'):
+                labels = self.computeHighlightLabels(selection, ids)
+        except Exception:
+            traceback.print_exc()
+            selection, labels = None, None
+        self.expansionFinished.emit(
+            (generation, start, ids, selection, labels))
+
+    @staticmethod
+    def mergeSelection(mode, selection, region):
+        """Apply a region to a selection in ADD, SEL or DEL mode."""
+        if mode == 'ADD':
+            return selection | region
+        elif mode == 'SEL':
+            return region
+        return selection - region
+
+    def selectArea(self, polygon):
+        """Apply the cells seen inside a screen region as one operation.
+
+        Args:
+            polygon (sequence): display coordinates of the vertices of the
+                region.
+        """
+        if self.selectionMode not in ('ADD', 'SEL', 'DEL'):
+            self.highlight()
+            return
 
-        mapper.SetInputData(selected)
-        actor.SetMapper(mapper)
-        actor.GetProperty().SetColor(*color)
+        start = time.perf_counter()
+        self.cancelExpansion()
+        with tracer.span('area'):
+            cellIds = None
+            if self.hardwareSelection:
+                cellIds = hardwareSelect(self.renderer, self.actor, polygon)
+            if cellIds is None:
+                cellIds = frustumSelect(self.renderer, self.polyData, polygon)
+            elif self.proxy is not None:
+                selected = np.zeros(self.proxy.polyData.GetNumberOfCells(),
+                                    dtype=bool)
+                selected[cellIds] = True
+                cellIds = np.flatnonzero(selected[self.proxy.originalToProxy])
+            region = Selection.fromIds(self.polyData.GetNumberOfCells(),
+                                       cellIds)
+        self.commitSelection(
+            self.mergeSelection(self.selectionMode, self.selection, region))
+        self.reportLatency(start)
+
+    def finishUpdate(self, result):
+        """Apply the result of an expansion job, on the GUI thread."""
+        generation, start, ids, selection, labels = result
+        if generation != self.generation:
+            return
 
-        self.interactor.GetRenderWindow().GetRenderers().GetFirstRenderer(
-        ).AddActor(actor)
+        self.cancelEvent = None
+        self.acceptEvent = None
+        self.busyChanged.emit(False)
+        self.previewShown = False
+        if selection is not None:
+            self.commitSelection(selection, labels)
+        else:
+            # Clear the preview of the failed job
+            self.highlight()
+        self.reportLatency(start)
+
+    def previewExpansion(self, progress):
+        """Show cells grown by the in-flight expansion, on the GUI thread."""
+        generation, cellIds = progress
+        if generation != self.generation:
+            return
 
+        self.previewShown = True
+        self.highlightLabels[cellIds] = HIGHLIGHT_PREVIEW
+        if self.proxy is not None:
+            self.displayLabels[self.proxy.originalToProxy[cellIds]] = \
+                HIGHLIGHT_PREVIEW
+        self.highlightArray.Modified()
         self.interactor.GetRenderWindow().Render()
 
+    def reportLatency(self, start):
+        if tracer.enabled:
+            tracer.add('click', start, time.perf_counter() - start)
+            self.latencyUpdated.emit(tracer.summary())
+
+    def computeHighlightLabels(self, selection, ids):
+        """Per-cell highlight labels of a selection, the other classes and
+        picked cells."""
+        labels = self.classHighlight[self.labelMap.labels]
+        labels[self.labelMap.labels == self.activeClass] = HIGHLIGHT_NONE
+        labels[selection.mask] = HIGHLIGHT_SELECTED
+        labels[numpy_support.vtk_to_numpy(ids)] = HIGHLIGHT_PICKED
+        return labels
+
+    def highlight(self, labels=None):
+        with tracer.span('highlight'):
+            if labels is None:
+                labels = self.computeHighlightLabels(self.selection, self.ids)
+
+            # Only write the cells whose label changed
+            changed = np.flatnonzero(labels != self.highlightLabels)
+            if changed.shape[0] > 0:
+                self.highlightLabels[changed] = labels[changed]
+                if self.proxy is not None:
+                    self.displayLabels[:] = self.proxy.displayLabels(
+                        labels, numpy_support.vtk_to_numpy(self.ids))
+                self.highlightArray.Modified()
+
+        with tracer.span('render'):
+            self.interactor.GetRenderWindow().Render()
+
     def start(self):
 
         style = MouseInteractorPickCell(self.polyData, self)
@@ -141,6 +575,9 @@ class ToothViewer(QFrame):
 
 
 class ToothViewerApp(QMainWindow):
+    # emitted from the writing thread with a status message
+    saveFinished = pyqtSignal(str)
+
     def __init__(self):
         super(ToothViewerApp, self).__init__()
 
@@ -165,12 +602,46 @@ class ToothViewerApp(QMainWindow):
         IOPanel.addWidget(self.loadButton)
         IOPanel.addWidget(self.saveButton)
 
+        # Label transfer from an aligned labeled mesh, 0 mm for no cutoff
+        self.transferButton = QPushButton('TRANSFER')
+        self.transferDistanceSpinBox = QDoubleSpinBox()
+        self.transferDistanceSpinBox.setRange(0, 10)
+        self.transferDistanceSpinBox.setSingleStep(0.1)
+        self.transferDistanceSpinBox.setSuffix(' mm')
+        self.transferDistanceSpinBox.setValue(0.5)
+        transferPanel = QHBoxLayout()
+        transferPanel.addWidget(self.transferButton)
+        transferPanel.addWidget(self.transferDistanceSpinBox)
+
+        # Trace Panel Initialization
+        self.traceButton = QPushButton('TRACE')
+        self.traceButton.setCheckable(True)
+        self.dumpTraceButton = QPushButton('DUMP TRACE')
+        self.lodButton = QPushButton('LOD')
+        self.lodButton.setCheckable(True)
+        tracePanel = QHBoxLayout()
+        tracePanel.addWidget(self.lodButton)
+        tracePanel.addWidget(self.traceButton)
+        tracePanel.addWidget(self.dumpTraceButton)
+
         # Selection Mode Panel Iitialization
         self.noSelectionButton = QPushButton('PICK')
         self.selectButton = QPushButton('SELECT')
         self.addSelectionButton = QPushButton('ADD')
         self.minusSelectionButton = QPushButton('MINUS')
         self.reverseButton = QPushButton('REVERSE')
+        self.redoButton = QPushButton('REDO')
+        self.rectangleButton = QPushButton('RECT')
+        self.lassoButton = QPushButton('LASSO')
+        self.rectangleButton.setCheckable(True)
+        self.lassoButton.setCheckable(True)
+        areaPanel = QHBoxLayout()
+        areaPanel.addWidget(self.rectangleButton)
+        areaPanel.addWidget(self.lassoButton)
+        self.classSpinBox = QSpinBox()
+        self.classSpinBox.setRange(1, 2**16 - 1)
+        self.classSpinBox.setPrefix('CLASS ')
+        self.classSpinBox.setValue(self.toothViewer.activeClass)
 
         self.noSelectionButton.setAutoExclusive(True)
         self.selectButton.setAutoExclusive(True)
@@ -184,11 +655,14 @@ class ToothViewerApp(QMainWindow):
         self.noSelectionButton.setChecked(True)
 
         selectionModePanel = QVBoxLayout()
+        selectionModePanel.addWidget(self.classSpinBox)
         selectionModePanel.addWidget(self.noSelectionButton)
         selectionModePanel.addWidget(self.selectButton)
         selectionModePanel.addWidget(self.addSelectionButton)
         selectionModePanel.addWidget(self.minusSelectionButton)
+        selectionModePanel.addLayout(areaPanel)
         selectionModePanel.addWidget(self.reverseButton)
+        selectionModePanel.addWidget(self.redoButton)
 
         # Selection Method Panel Initalization
 
@@ -231,9 +705,36 @@ class ToothViewerApp(QMainWindow):
         angleMode.addLayout(self.angleThresholdSliderLayout)
         angleMode.addWidget(self.angleCount)
 
-        selectionMethodPanel = QHBoxLayout()
-        selectionMethodPanel.addLayout(neighborMode)
-        selectionMethodPanel.addLayout(angleMode)
+        self.geodesicButton = QPushButton('GEODESIC')
+        self.geodesicButton.setCheckable(True)
+        self.radiusSpinBox = QDoubleSpinBox()
+        self.radiusSpinBox.setRange(0, 50)
+        self.radiusSpinBox.setSingleStep(0.5)
+        self.radiusSpinBox.setSuffix(' mm')
+        self.radiusSpinBox.setValue(self.toothViewer.radius)
+        geodesicMode = QHBoxLayout()
+        geodesicMode.addWidget(self.geodesicButton)
+        geodesicMode.addWidget(self.radiusSpinBox)
+
+        self.curvatureButton = QPushButton('CURVATURE')
+        self.curvatureButton.setCheckable(True)
+        self.curvatureSpinBox = QDoubleSpinBox()
+        self.curvatureSpinBox.setRange(0, 100)
+        self.curvatureSpinBox.setSingleStep(0.1)
+        self.curvatureSpinBox.setSuffix(' /mm')
+        self.curvatureSpinBox.setValue(self.toothViewer.curvatureThreshold)
+        curvatureMode = QHBoxLayout()
+        curvatureMode.addWidget(self.curvatureButton)
+        curvatureMode.addWidget(self.curvatureSpinBox)
+
+        thresholdPanel = QHBoxLayout()
+        thresholdPanel.addLayout(neighborMode)
+        thresholdPanel.addLayout(angleMode)
+
+        selectionMethodPanel = QVBoxLayout()
+        selectionMethodPanel.addLayout(thresholdPanel)
+        selectionMethodPanel.addLayout(geodesicMode)
+        selectionMethodPanel.addLayout(curvatureMode)
 
         # Selection Algorithm Panel Initalization
         self.inverseButton = QPushButton('INVERSE')
@@ -243,19 +744,79 @@ class ToothViewerApp(QMainWindow):
         selectionAlgorithmPanel.addWidget(self.inverseButton)
         selectionAlgorithmPanel.addWidget(self.removeOutlierButton)
 
+        self.componentSizeSpinBox = QSpinBox()
+        self.componentSizeSpinBox.setRange(1, 1000000)
+        self.componentSizeSpinBox.setValue(100)
+        self.componentSizeSpinBox.setSuffix(' cells')
+        self.dropSmallButton = QPushButton('DROP SMALL')
+        self.fillHolesButton = QPushButton('FILL HOLES')
+        componentPanel = QHBoxLayout()
+        componentPanel.addWidget(self.dropSmallButton)
+        componentPanel.addWidget(self.fillHolesButton)
+        selectionAlgorithmPanel.addWidget(self.componentSizeSpinBox)
+        selectionAlgorithmPanel.addLayout(componentPanel)
+
+        # Boundary smoothing by rings, or by mm when the radius is above 0
+        self.dilateButton = QPushButton('DILATE')
+        self.erodeButton = QPushButton('ERODE')
+        self.openButton = QPushButton('OPEN')
+        self.closeButton = QPushButton('CLOSE')
+        self.morphologyRingsSpinBox = QSpinBox()
+        self.morphologyRingsSpinBox.setRange(1, 50)
+        self.morphologyRingsSpinBox.setValue(1)
+        self.morphologyRingsSpinBox.setSuffix(' rings')
+        self.morphologyRadiusSpinBox = QDoubleSpinBox()
+        self.morphologyRadiusSpinBox.setRange(0, 10)
+        self.morphologyRadiusSpinBox.setSingleStep(0.1)
+        self.morphologyRadiusSpinBox.setSuffix(' mm')
+        morphologyPanel = QHBoxLayout()
+        morphologyPanel.addWidget(self.dilateButton)
+        morphologyPanel.addWidget(self.erodeButton)
+        morphologyPanel.addWidget(self.openButton)
+        morphologyPanel.addWidget(self.closeButton)
+        morphologySizePanel = QHBoxLayout()
+        morphologySizePanel.addWidget(self.morphologyRingsSpinBox)
+        morphologySizePanel.addWidget(self.morphologyRadiusSpinBox)
+        selectionAlgorithmPanel.addLayout(morphologyPanel)
+        selectionAlgorithmPanel.addLayout(morphologySizePanel)
+
         # Function Connection
         self.loadButton.clicked.connect(self.loadSTL)
+        self.saveFinished.connect(self.statusBar().showMessage)
+        self.toothViewer.latencyUpdated.connect(self.statusBar().showMessage)
+        self.toothViewer.busyChanged.connect(self.showBusy)
+        self.toothViewer.autosaveFailed.connect(self.statusBar().showMessage)
+        self.traceButton.toggled.connect(self.toggleTrace)
+        self.lodButton.toggled.connect(self.toggleLevelOfDetail)
+        self.dumpTraceButton.clicked.connect(self.dumpTrace)
         self.saveButton.clicked.connect(self.saveVTP)
+        self.transferButton.clicked.connect(self.transferLabels)
         self.neighborThresholdSlider.valueChanged.connect(
             self.adjustNeighborThreshold)
         self.angleThresholdSlider.valueChanged.connect(
             self.adjustAngleThreshold)
+        self.geodesicButton.toggled.connect(self.switchExpansionMethod)
+        self.radiusSpinBox.valueChanged.connect(self.adjustRadius)
+        self.curvatureButton.toggled.connect(self.switchExpansionMethod)
+        self.curvatureSpinBox.valueChanged.connect(
+            self.adjustCurvatureThreshold)
+        self.classSpinBox.valueChanged.connect(
+            self.toothViewer.setActiveClass)
         self.noSelectionButton.clicked.connect(self.switchSelectionMode)
         self.addSelectionButton.clicked.connect(self.switchSelectionMode)
         self.selectButton.clicked.connect(self.switchSelectionMode)
         self.minusSelectionButton.clicked.connect(self.switchSelectionMode)
+        self.rectangleButton.toggled.connect(self.switchAreaMode)
+        self.lassoButton.toggled.connect(self.switchAreaMode)
         self.reverseButton.clicked.connect(self.reverseOperation)
+        self.redoButton.clicked.connect(self.redoOperation)
         self.removeOutlierButton.clicked.connect(self.removeOutlier)
+        self.dropSmallButton.clicked.connect(self.dropSmallComponents)
+        self.fillHolesButton.clicked.connect(self.fillHoles)
+        self.dilateButton.clicked.connect(self.applyMorphology)
+        self.erodeButton.clicked.connect(self.applyMorphology)
+        self.openButton.clicked.connect(self.applyMorphology)
+        self.closeButton.clicked.connect(self.applyMorphology)
         self.inverseButton.clicked.connect(self.inverse)
 
         # Entire layout
@@ -264,6 +825,8 @@ class ToothViewerApp(QMainWindow):
         panel.addLayout(selectionMethodPanel)
         panel.addLayout(selectionAlgorithmPanel)
         panel.addLayout(IOPanel)
+        panel.addLayout(transferPanel)
+        panel.addLayout(tracePanel)
 
         vbox = QHBoxLayout()
         vbox.addWidget(self.toothViewer)
@@ -278,22 +841,106 @@ class ToothViewerApp(QMainWindow):
         self.toothViewer.start()
 
     def inverse(self):
-        self.toothViewer.selected_ids = inverseSelection(
-            self.toothViewer.polyData, self.toothViewer.selected_ids)
-        self.toothViewer.highlight()
+        self.toothViewer.setSelection(~self.toothViewer.selection)
 
     def removeOutlier(self):
-        if self.toothViewer.selected_ids.GetNumberOfValues() > 0:
-            self.toothViewer.selected_ids = onSelectedExpand(
-                self.toothViewer.polyData, self.toothViewer.ids,
-                self.toothViewer.selected_ids)
-            self.toothViewer.highlight()
+        """Keep the component of the last pick, or the largest one."""
+        selection = self.toothViewer.selection
+        if selection:
+            ids = numpy_support.vtk_to_numpy(self.toothViewer.ids)
+            if selection.mask[ids].any():
+                mask = cleanSelection(self.toothViewer.polyData,
+                                      selection.mask,
+                                      seeds=ids)
+            else:
+                mask = cleanSelection(self.toothViewer.polyData,
+                                      selection.mask,
+                                      keepLargest=True)
+            self.toothViewer.setSelection(
+                Selection(selection.numberOfCells, mask))
+
+    def dropSmallComponents(self):
+        selection = self.toothViewer.selection
+        if selection:
+            mask = cleanSelection(self.toothViewer.polyData,
+                                  selection.mask,
+                                  minCells=self.componentSizeSpinBox.value())
+            self.toothViewer.setSelection(
+                Selection(selection.numberOfCells, mask))
+
+    def fillHoles(self):
+        selection = self.toothViewer.selection
+        if selection:
+            mask = cleanSelection(
+                self.toothViewer.polyData,
+                selection.mask,
+                maxHoleCells=self.componentSizeSpinBox.value())
+            self.toothViewer.setSelection(
+                Selection(selection.numberOfCells, mask))
+
+    def applyMorphology(self):
+        """Dilate, erode, open or close the selection, per the button."""
+        selection = self.toothViewer.selection
+        if selection:
+            operation = {
+                self.dilateButton: dilateSelection,
+                self.erodeButton: erodeSelection,
+                self.openButton: openSelection,
+                self.closeButton: closeSelection,
+            }[self.sender()]
+            radius = self.morphologyRadiusSpinBox.value() or None
+            mask = operation(self.toothViewer.polyData,
+                             selection.mask,
+                             rings=self.morphologyRingsSpinBox.value(),
+                             radius=radius)
+            self.toothViewer.setSelection(
+                Selection(selection.numberOfCells, mask))
 
     def reverseOperation(self):
-        if len(self.toothViewer.selected_ids_list) > 0:
-            self.toothViewer.selected_ids = self.toothViewer.selected_ids_list.pop(
-            )
-            self.toothViewer.highlight()
+        self.toothViewer.undo()
+
+    def redoOperation(self):
+        self.toothViewer.redo()
+
+    def closeEvent(self, event):
+        self.toothViewer.cancelExpansion()
+        self.toothViewer.executor.shutdown(wait=False)
+        if self.toothViewer.sessionFile is not None:
+            self.toothViewer.autosaver.save(self.toothViewer.sessionFile,
+                                            self.toothViewer.sessionState())
+        self.toothViewer.autosaver.shutdown(wait=True)
+        super(ToothViewerApp, self).closeEvent(event)
+
+    def showBusy(self, busy):
+        if busy:
+            self.toothViewer.setCursor(Qt.BusyCursor)
+            self.statusBar().showMessage(
+                'Expanding... (Enter to accept, Esc to abort)')
+        else:
+            self.toothViewer.unsetCursor()
+            if not tracer.enabled:
+                self.statusBar().showMessage('Ready')
+
+    def toggleTrace(self, enabled):
+        tracer.enable(enabled)
+        self.statusBar().showMessage(
+            'Tracing enabled' if enabled else 'Tracing disabled')
+
+    def toggleLevelOfDetail(self, enabled):
+        self.toothViewer.setLevelOfDetail(enabled)
+        if enabled and self.toothViewer.proxy is not None:
+            self.statusBar().showMessage('Rendering {} of {} cells'.format(
+                self.toothViewer.proxy.polyData.GetNumberOfCells(),
+                self.toothViewer.polyData.GetNumberOfCells()))
+
+    def dumpTrace(self):
+        filename = QFileDialog.getSaveFileName(self, 'Save Trace',
+                                               'trace.json',
+                                               filter='Chrome Trace (*.json)')
+        if filename[0] == '':
+            return
+        tracer.dumpChromeTrace(filename[0])
+        self.statusBar().showMessage('Saved {}'.format(filename[0]))
 
     def switchSelectionMode(self):
         if self.addSelectionButton.isChecked():
@@ -305,12 +952,49 @@ class ToothViewerApp(QMainWindow):
         else:
             self.toothViewer.selectionMode = 'PIC'
 
+    def switchAreaMode(self, checked):
+        # RECT and LASSO exclude each other but may both be unchecked
+        if checked:
+            other = self.lassoButton if self.sender() is \
+                self.rectangleButton else self.rectangleButton
+            other.setChecked(False)
+        if self.rectangleButton.isChecked():
+            self.toothViewer.areaMode = 'RECT'
+        elif self.lassoButton.isChecked():
+            self.toothViewer.areaMode = 'LASSO'
+        else:
+            self.toothViewer.areaMode = None
+
     def adjustNeighborThreshold(self):
+        self.toothViewer.cancelExpansion()
         self.neighborCount.setText(str(self.neighborThresholdSlider.value()))
         self.toothViewer.neighborThreshold = self.neighborThresholdSlider.value(
         )
 
+    def switchExpansionMethod(self, checked):
+        # GEODESIC and CURVATURE exclude each other, NEIGHBOR when neither
+        if checked:
+            other = self.curvatureButton if self.sender() is \
+                self.geodesicButton else self.geodesicButton
+            other.setChecked(False)
+        self.toothViewer.cancelExpansion()
+        if self.geodesicButton.isChecked():
+            self.toothViewer.expansionMethod = 'GEODESIC'
+        elif self.curvatureButton.isChecked():
+            self.toothViewer.expansionMethod = 'CURVATURE'
+        else:
+            self.toothViewer.expansionMethod = 'NEIGHBOR'
+
+    def adjustRadius(self, radius):
+        self.toothViewer.cancelExpansion()
+        self.toothViewer.radius = radius
+
+    def adjustCurvatureThreshold(self, curvature):
+        self.toothViewer.cancelExpansion()
+        self.toothViewer.curvatureThreshold = curvature
+
     def adjustAngleThreshold(self):
+        self.toothViewer.cancelExpansion()
         self.angleCount.setText(str(self.angleThresholdSlider.value()))
         self.toothViewer.angleThreshold = self.angleThresholdSlider.value()
 
@@ -320,23 +1004,89 @@ class ToothViewerApp(QMainWindow):
                                                filter='3D Object(*.stl)')
 
         if filename[0] != '':
-            polyData = readSTL(filename[0])
+            polyData = readSTLFast(filename[0])
         else:
             return
 
-        self.toothViewer.renderer.RemoveAllViewProps()
-        self.toothViewer.polyData = polyData
-
-        toothMapper = vtk.vtkPolyDataMapper()
-        toothMapper.SetInputData(self.toothViewer.polyData)
-        toothActor = vtk.vtkActor()
-        toothActor.SetMapper(toothMapper)
-
-        self.toothViewer.renderer.AddActor(toothActor)
-        self.toothViewer.renderer.ResetCamera()
+        # Save the session of the current mesh, edits since the last
+        # autosave would be lost otherwise
+        self.toothViewer.cancelExpansion()
+        if self.toothViewer.sessionFile is not None:
+            self.toothViewer.autosaver.save(self.toothViewer.sessionFile,
+                                            self.toothViewer.sessionState())
+
+        # Features cached by featurecache.py are mapped, not recomputed
+        digest = meshHash(polyData)
+        if not loadFeatures(polyData, digest):
+            cacheGeometry(polyData)
+
+        self.toothViewer.setPolyData(polyData)
+        self.toothViewer.meshHash = digest
+        self.toothViewer.sessionFile = sessionFilename(filename[0])
         self.toothViewer.renderWindow.Render()
 
         self.loadFilePath = filename
+        self.offerSessionRestore()
+
+    def offerSessionRestore(self):
+        """Offer to restore the saved session of the loaded mesh."""
+        sessionFile = self.toothViewer.sessionFile
+        if not os.path.exists(sessionFile):
+            return
+        try:
+            state = loadSession(sessionFile, self.toothViewer.meshHash)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            self.statusBar().showMessage('Session not restored: {}'.format(e))
+            return
+
+        answer = QMessageBox.question(
+            self, 'Restore Session',
+            'Restore the labeling session saved for this mesh?',
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if answer != QMessageBox.Yes:
+            return
+
+        self.toothViewer.restoreSession(state)
+        settings = state['settings']
+        self.neighborThresholdSlider.setValue(settings['neighborThreshold'])
+        self.angleThresholdSlider.setValue(settings['angleThreshold'])
+        self.radiusSpinBox.setValue(settings['radius'])
+        self.curvatureSpinBox.setValue(
+            settings.get('curvatureThreshold',
+                         self.toothViewer.curvatureThreshold))
+        self.geodesicButton.setChecked(
+            settings['expansionMethod'] == 'GEODESIC')
+        self.curvatureButton.setChecked(
+            settings['expansionMethod'] == 'CURVATURE')
+        self.classSpinBox.setValue(state['activeClass'])
+        self.statusBar().showMessage('Restored {}'.format(sessionFile))
+
+    def transferLabels(self):
+        """Pre-label the mesh from an aligned labeled mesh."""
+        filename = QFileDialog.getOpenFileName(
+            self, 'Select labeled mesh',
+            filter='Labeled mesh (*.vtp *.vtk *.stl)')
+        if filename[0] == '':
+            return
+
+        try:
+            source, sourceLabels, _ = readLabeledMesh(filename[0])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            self.statusBar().showMessage(
+                'Labels not transferred: {}'.format(e))
+            return
+        # Cells facing away from their source cell, such as the other
+        # side of a thin wall, are left unlabeled
+        maxDistance = self.transferDistanceSpinBox.value() or None
+        labels = transferLabels(source,
+                                sourceLabels,
+                                self.toothViewer.polyData,
+                                maxDistance=maxDistance,
+                                maxAngle=90)
+        self.toothViewer.addLabels(labels)
+        self.statusBar().showMessage(
+            'Transferred {} labeled cells from {}'.format(
+                np.count_nonzero(labels), filename[0]))
 
     def saveVTP(self):
         if self.loadFilePath:
@@ -346,36 +1096,43 @@ class ToothViewerApp(QMainWindow):
             default_filename = '.'
         filename = QFileDialog.getSaveFileName(
             self, 'Save File', default_filename,
-            filter='VTK Polygonal Data (*.vtp)')
+            filter='VTK Polygonal Data (*.vtp);;Labels only (*.npz)')
 
         if filename[0] == '':
             return
 
-        polyData = vtk.vtkPolyData()
-        polyData.DeepCopy(self.toothViewer.polyData)
-        # Cell Label
-        cellLabels = np.zeros(polyData.GetNumberOfCells(), dtype=np.uint8)
-        selectedCellIds = set([
-            self.toothViewer.selected_ids.GetValue(i)
-            for i in range(self.toothViewer.selected_ids.GetNumberOfValues())
-        ])
-        cellLabels[np.array(list(selectedCellIds), np.int32)] = 1
-        polyData.GetCellData().SetScalars(
-            numpy_support.numpy_to_vtk(cellLabels))
-        # Point Label
-        pointLabels = np.zeros(polyData.GetNumberOfPoints(), dtype=np.uint8)
-        pointIds = set()
-        for cellId in selectedCellIds:
-            cellPointIds = vtk.vtkIdList()
-            polyData.GetCellPoints(cellId, cellPointIds)
-            for i in range(cellPointIds.GetNumberOfIds()):
-                pointIds.add(cellPointIds.GetId(i))
-        pointLabels[np.array(list(pointIds), np.int32)] = 1
-        polyData.GetPointData().SetScalars(
-            numpy_support.numpy_to_vtk(pointLabels))
-
-        writeVTP(polyData, filename[0])
-
+        # All classes in one write, copied as labeling goes on meanwhile
+        cellLabels = self.toothViewer.labelMap.labels.copy()
+        if filename[0].endswith('.npz'):
+            # Label sidecar, the geometry is not written again
+            self.writeInBackground(writeLabels, self.toothViewer.polyData,
+                                   cellLabels, filename[0])
+        else:
+            self.writeInBackground(
+                writeVTP, labelPolyData(self.toothViewer.polyData,
+                                        cellLabels), filename[0])
+
+    def writeInBackground(self, write, *args):
+        """Run a write function on a thread, reporting in the status bar.
+
+        Args:
+            write (callable): function writing the file named by its last
+                argument.
+            args: arguments of `write`.
+        """
+        filename = args[-1]
+        self.statusBar().showMessage('Saving {}...'.format(filename))
+
+        def run():
+            try:
+                write(*args)
+            except Exception as e:
+                self.saveFinished.emit('Failed to save {}: {}'.format(
+                    filename, e))
+            else:
+                self.saveFinished.emit('Saved {}'.format(filename))
+
+        threading.Thread(target=run).start()
 
 if __name__ == '__main__':
 
@@ -0,0 +1,215 @@
+"""Per-mesh cache of derived data.
+
+Data derived from a loaded vtkPolyData is computed once and reused by the
+functions in `algorithm` until the geometry of the mesh is modified.
+"""
+import weakref
+
+import numpy as np
+from vtk.util import numpy_support
+
+_caches = dict()
+
+
+def getMeshCache(polyData):
+    """Get the cache of a mesh, building it if missing or outdated.
+
+    Args:
+        polyData (vtkPolyData): mesh the cache belongs to.
+
+    Returns:
+        MeshCache: cache of the mesh.
+    """
+    key = id(polyData)
+    cache = _caches.get(key)
+    if cache is None or cache.mtime != meshMTime(polyData):
+        if cache is None:
+            weakref.finalize(polyData, _caches.pop, key, None)
+        cache = MeshCache(polyData)
+        _caches[key] = cache
+    return cache
+
+
+def setMeshCache(polyData, cache):
+    """Use a cache built elsewhere, such as loaded from disk, for a mesh.
+
+    Args:
+        polyData (vtkPolyData): mesh the cache belongs to.
+        cache (MeshCache): cache of the geometry of `polyData`.
+    """
+    key = id(polyData)
+    if key not in _caches:
+        weakref.finalize(polyData, _caches.pop, key, None)
+    cache.mtime = meshMTime(polyData)
+    _caches[key] = cache
+
+
+def meshMTime(polyData):
+    """Modified time of the geometry (points and polys) of a mesh.
+
+    Data arrays attached to the mesh (labels, colors) are ignored, so that
+    they can be changed without invalidating the cache.
+    """
+    mtime = polyData.GetPolys().GetMTime()
+    if polyData.GetPoints() is not None:
+        mtime = max(mtime, polyData.GetPoints().GetMTime())
+    return mtime
+
+
+def gatherRows(indptr, indices, rows):
+    """Concatenate the rows of a CSR structure.
+
+    Args:
+        indptr (np.ndarray): row offsets, of length number of rows + 1.
+        indices (np.ndarray): column indices.
+        rows (np.ndarray): rows to be gathered.
+
+    Returns:
+        np.ndarray: column indices of all `rows`, row after row.
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return indices[offsets + np.arange(offsets.shape[0])]
+
+
+class MeshCache(object):
+    """Derived data of a polygonal mesh.
+
+    Attributes:
+        mtime (int): geometry modified time the cache was built for.
+        numberOfCells (int): number of cells of the mesh.
+        cellPoints (tuple): CSR (indptr, indices) of the points of each cell.
+        pointCells (tuple): CSR (indptr, indices) of the cells using each
+            point.
+        adjacency (tuple): CSR (indptr, indices) of the cells sharing at
+            least one point with each cell, the cell itself excluded.
+        sharedPoints (np.ndarray): number of points shared by each pair of
+            `adjacency`, 2 or more for cells sharing an edge.
+        cellNormals (np.ndarray): consistent normal of each cell.
+        cellCentroids (np.ndarray): centroid of each cell.
+        cellAreas (np.ndarray): area of each cell.
+        pointCurvature (np.ndarray): Gaussian curvature of each point.
+        cellCurvature (np.ndarray): Gaussian curvature of each cell, mean of
+            its points.
+        pointMeanCurvature (np.ndarray): mean curvature of each point.
+        cellMeanCurvature (np.ndarray): mean curvature of each cell, mean of
+            its points.
+        centroidGraph (tuple): CSR (indptr, indices) of the cells sharing an
+            edge with each cell, and the distance between their centroids.
+
+    The geometry attributes are None until filled by the accessors of
+    `algorithm`.
+    """
+
+    # Data saved by `toArrays`, CSR structures as several arrays
+    ARRAYS = ('pointCells', 'adjacency', 'sharedPoints', 'cellNormals',
+              'cellCentroids', 'cellAreas', 'pointCurvature', 'cellCurvature',
+              'pointMeanCurvature', 'cellMeanCurvature', 'centroidGraph')
+
+    def __init__(self, polyData):
+        self._setCellPoints(polyData)
+        numberOfPoints = polyData.GetNumberOfPoints()
+        offsets, connectivity = self.cellPoints
+
+        # Inverse the cell -> point incidence into point -> cell.
+        incidentCells = np.repeat(
+            np.arange(self.numberOfCells, dtype=np.int64), np.diff(offsets))
+        order = np.argsort(connectivity, kind='stable')
+        pointIndptr = np.zeros(numberOfPoints + 1, dtype=np.int64)
+        np.cumsum(np.bincount(connectivity, minlength=numberOfPoints),
+                  out=pointIndptr[1:])
+        self.pointCells = (pointIndptr, incidentCells[order])
+
+        self.adjacency, self.sharedPoints = self._buildAdjacency(
+            incidentCells, connectivity)
+
+        self.cellNormals = None
+        self.cellCentroids = None
+        self.cellAreas = None
+        self.pointCurvature = None
+        self.cellCurvature = None
+        self.pointMeanCurvature = None
+        self.cellMeanCurvature = None
+        self.centroidGraph = None
+
+    def _setCellPoints(self, polyData):
+        self.mtime = meshMTime(polyData)
+        self.numberOfCells = polyData.GetNumberOfCells()
+
+        polys = polyData.GetPolys()
+        if polys.GetNumberOfCells() != self.numberOfCells:
+            raise ValueError('Only meshes made of polys are supported.')
+
+        offsets = numpy_support.vtk_to_numpy(
+            polys.GetOffsetsArray()).astype(np.int64)
+        connectivity = numpy_support.vtk_to_numpy(
+            polys.GetConnectivityArray()).astype(np.int64)
+        self.cellPoints = (offsets, connectivity)
+
+    def toArrays(self):
+        """Filled data of the cache as a flat dict of arrays.
+
+        Returns:
+            dict: arrays by name, `name_i` for the i-th array of a tuple.
+        """
+        arrays = dict()
+        for name in self.ARRAYS:
+            value = getattr(self, name)
+            if isinstance(value, tuple):
+                for i, array in enumerate(value):
+                    arrays['{}_{}'.format(name, i)] = array
+            elif value is not None:
+                arrays[name] = value
+        return arrays
+
+    @classmethod
+    def fromArrays(cls, polyData, arrays):
+        """Cache of a mesh from the arrays of `toArrays`, without computing.
+
+        Args:
+            polyData (vtkPolyData): mesh the arrays were computed for.
+            arrays (dict): arrays by name, possibly memory-mapped.
+
+        Returns:
+            MeshCache: cache of the mesh.
+        """
+        cache = cls.__new__(cls)
+        cache._setCellPoints(polyData)
+        for name in cls.ARRAYS:
+            parts = sorted(key for key in arrays
+                           if key.startswith(name + '_') and
+                           key[len(name) + 1:].isdigit())
+            if parts:
+                value = tuple(arrays['{}_{}'.format(name, i)]
+                              for i in range(len(parts)))
+            else:
+                value = arrays.get(name)
+            setattr(cache, name, value)
+
+        if cache.adjacency is None or cache.adjacency[0].shape[0] != \
+                cache.numberOfCells + 1:
+            raise ValueError('Arrays of another mesh.')
+        return cache
+
+    def _buildAdjacency(self, incidentCells, connectivity):
+        pointIndptr, pointIndices = self.pointCells
+        degrees = np.diff(pointIndptr)
+
+        sources = np.repeat(incidentCells, degrees[connectivity])
+        targets = gatherRows(pointIndptr, pointIndices, connectivity)
+        keep = sources != targets
+        keys, shared = np.unique(
+            sources[keep] * self.numberOfCells + targets[keep],
+            return_counts=True)
+
+        indptr = np.zeros(self.numberOfCells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // self.numberOfCells,
+                              minlength=self.numberOfCells),
+                  out=indptr[1:])
+        indices = keys % self.numberOfCells
+        return (indptr, indices), shared.astype(np.uint8)
+
+    def neighbors(self, cellIds):
+        """Cells sharing a point with any of `cellIds`, with repetitions."""
+        return gatherRows(self.adjacency[0], self.adjacency[1], cellIds)
@@ -0,0 +1,226 @@
+"""Cell picking accelerated by a persistent cell locator.
+
+The locator of a mesh is built once, when the mesh is loaded, and shared by
+the screen picker of the viewer and by world space ray queries, which need
+no display. Cells inside a screen region are selected by a hardware
+selection pass, or by a vectorized test of the cell centroids.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from algorithm import getCellCentroids, getCellNormals
+
+
+def buildCellLocator(polyData):
+    """Static cell locator of a mesh, for ray and closest point queries.
+
+    The locator is never rebuilt on its own: changing the arrays of the mesh,
+    such as the highlight labels, modifies it and would otherwise rebuild
+    the locator on the next query. Build a new one when the geometry
+    changes.
+    """
+    locator = vtk.vtkStaticCellLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+    locator.UseExistingSearchStructureOn()
+    return locator
+
+
+class CellPicker(object):
+    """Picker of the cells of a mesh hit by rays.
+
+    Args:
+        polyData (vtkPolyData): mesh to be picked.
+        locator (vtkAbstractCellLocator): built locator of `polyData`, built
+            here if None.
+    """
+
+    def __init__(self, polyData, locator=None):
+        self.polyData = polyData
+        self.locator = locator if locator is not None else buildCellLocator(
+            polyData)
+        bounds = np.array(polyData.GetBounds()).reshape(3, 2)
+        self.center = bounds.mean(axis=1)
+        self.diagonal = np.linalg.norm(bounds[:, 1] - bounds[:, 0])
+
+    def pickRay(self, origin, direction):
+        """First cell hit by a ray.
+
+        Args:
+            origin (sequence): origin of the ray in world coordinates.
+            direction (sequence): direction of the ray.
+
+        Returns:
+            tuple: id of the cell hit, -1 if none, and the hit position.
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        # Long enough to go through the whole mesh
+        end = origin + direction * (self.diagonal +
+                                    np.linalg.norm(origin - self.center))
+
+        t = vtk.reference(0.0)
+        position = [0.0, 0.0, 0.0]
+        pcoords = [0.0, 0.0, 0.0]
+        subId = vtk.reference(0)
+        cellId = vtk.reference(-1)
+        if not self.locator.IntersectWithLine(origin.tolist(), end.tolist(),
+                                              0.0, t, position, pcoords,
+                                              subId, cellId):
+            return -1, None
+        return int(cellId), tuple(position)
+
+    def pickRays(self, origins, directions):
+        """First cell hit by each of a set of rays.
+
+        Args:
+            origins (np.ndarray): (N, 3) origins of the rays.
+            directions (np.ndarray): (N, 3) directions of the rays.
+
+        Returns:
+            np.ndarray: id of the cell hit by each ray, -1 if none.
+        """
+        cellIds = [
+            self.pickRay(origin, direction)[0]
+            for origin, direction in zip(origins, directions)
+        ]
+        return np.array(cellIds, dtype=np.int64)
+
+
+def projectToDisplay(renderer, points):
+    """Display coordinates of world points, vectorized.
+
+    Args:
+        renderer (vtkRenderer): renderer whose camera projects the points.
+        points (np.ndarray): (N, 3) world coordinates.
+
+    Returns:
+        tuple: (N, 2) display coordinates and (N,) normalized depth, in
+            [-1, 1] between the clipping planes.
+    """
+    camera = renderer.GetActiveCamera()
+    matrix = camera.GetCompositeProjectionTransformMatrix(
+        renderer.GetTiledAspectRatio(), -1, 1)
+    transform = np.array([[matrix.GetElement(i, j) for j in range(4)]
+                          for i in range(4)])
+    projected = points @ transform[:3, :3].T + transform[:3, 3]
+    w = points @ transform[3, :3] + transform[3, 3]
+    normalized = projected / w[:, None]
+
+    width, height = renderer.GetSize()
+    x0, y0 = renderer.GetOrigin()
+    display = np.empty((points.shape[0], 2))
+    display[:, 0] = x0 + (normalized[:, 0] + 1.0) * 0.5 * width
+    display[:, 1] = y0 + (normalized[:, 1] + 1.0) * 0.5 * height
+    return display, normalized[:, 2]
+
+
+def insidePolygon(points, polygon):
+    """Even-odd test of 2D points against a polygon, vectorized over points.
+
+    Args:
+        points (np.ndarray): (N, 2) points.
+        polygon (np.ndarray): (M, 2) vertices of the polygon, M >= 3.
+
+    Returns:
+        np.ndarray: bool mask of the points inside the polygon.
+    """
+    polygon = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(points.shape[0], dtype=bool)
+    # Only points within the bounds of the polygon can be inside
+    candidates = np.flatnonzero(
+        np.all((points >= polygon.min(axis=0)) &
+               (points <= polygon.max(axis=0)),
+               axis=1))
+    x = points[candidates, 0]
+    y = points[candidates, 1]
+    crossings = np.zeros(candidates.shape[0], dtype=bool)
+    for (ax, ay), (bx, by) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if ay == by:
+            continue
+        straddle = (ay > y) != (by > y)
+        crossings ^= straddle & (x < ax + (y - ay) * (bx - ax) / (by - ay))
+    inside[candidates] = crossings
+    return inside
+
+
+def frustumSelect(renderer, polyData, polygon):
+    """Cells of a mesh seen inside a screen region, by a centroid test.
+
+    Keeps the cells whose centroid projects inside `polygon`, between the
+    clipping planes, and that face the camera. Cells hidden behind other
+    front-facing parts of the mesh are not culled, use `hardwareSelect`
+    where rendering is available.
+
+    Args:
+        renderer (vtkRenderer): renderer showing the mesh.
+        polyData (vtkPolyData): mesh to be selected.
+        polygon (np.ndarray): (M, 2) display coordinates of the region.
+
+    Returns:
+        np.ndarray: selected cell ids.
+    """
+    centroids = getCellCentroids(polyData)
+    normals = getCellNormals(polyData)
+    display, depth = projectToDisplay(renderer, centroids)
+    candidates = np.flatnonzero(
+        insidePolygon(display, polygon) & (np.abs(depth) <= 1.0))
+
+    # Normals are consistent but may all point inward
+    outward = np.einsum('ij,ij->', normals,
+                        centroids - centroids.mean(axis=0)) >= 0
+    camera = renderer.GetActiveCamera()
+    if camera.GetParallelProjection():
+        views = np.array(camera.GetDirectionOfProjection())[None, :]
+    else:
+        views = centroids[candidates] - np.array(camera.GetPosition())
+    facing = np.einsum('ij,ij->i', normals[candidates],
+                       np.broadcast_to(views, (candidates.shape[0], 3))) < 0
+    return candidates[facing == outward]
+
+
+def hardwareSelect(renderer, actor, polygon):
+    """Visible cells of an actor inside a screen region, by a render pass.
+
+    Args:
+        renderer (vtkRenderer): renderer showing the actor.
+        actor (vtkActor): actor of the mesh to be selected.
+        polygon (np.ndarray): (M, 2) display coordinates of the region.
+
+    Returns:
+        np.ndarray: selected cell ids of the dataset of the actor, None
+            if the render window cannot select.
+    """
+    # The selector takes unsigned display coordinates within the renderer,
+    # regions may be dragged past its edges
+    width, height = renderer.GetSize()
+    polygon = np.clip(np.asarray(polygon, dtype=np.float64), 0,
+                      [width - 1, height - 1])
+    selector = vtk.vtkHardwareSelector()
+    selector.SetRenderer(renderer)
+    selector.SetFieldAssociation(vtk.vtkDataObject.FIELD_ASSOCIATION_CELLS)
+    low = np.floor(polygon.min(axis=0)).astype(int)
+    high = np.ceil(polygon.max(axis=0)).astype(int)
+    selector.SetArea(int(low[0]), int(low[1]), int(high[0]), int(high[1]))
+    if not selector.CaptureBuffers():
+        return None
+    points = np.round(polygon).astype(int).ravel().tolist()
+    selection = selector.GeneratePolygonSelection(points, len(points))
+    selector.ClearBuffers()
+    if selection is None:
+        return None
+
+    nodes = [
+        selection.GetNode(i) for i in range(selection.GetNumberOfNodes())
+    ]
+    cellIds = [
+        numpy_support.vtk_to_numpy(node.GetSelectionList()) for node in nodes
+        if node.GetProperties().Get(vtk.vtkSelectionNode.PROP()) is actor
+    ]
+    if nodes and not cellIds:
+        # Nodes of no prop, as given by contexts unable to select
+        return None
+    cellIds = np.unique(np.concatenate(cellIds + [np.empty(0, np.int64)]))
+    return cellIds[cellIds < actor.GetMapper().GetInput().GetNumberOfCells()]
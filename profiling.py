@@ -0,0 +1,113 @@
+"""Latency instrumentation of the interactive hot path.
+
+Stages of a pick are wrapped in named spans::
+
+    with tracer.span('expand'):
+        ...
+
+Spans are only recorded while the tracer is enabled; when disabled `span`
+returns a shared no-op context manager. Recorded spans give a rolling
+latency breakdown and can be dumped as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev).
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Tracer(object):
+    """Recorder of named spans.
+
+    Args:
+        maxEvents (int): number of most recent spans kept for the trace.
+        window (int): number of most recent spans per name averaged in the
+            latency breakdown.
+    """
+
+    def __init__(self, maxEvents=100000, window=20):
+        self.enabled = False
+        self.events = collections.deque(maxlen=maxEvents)
+        self.window = window
+        self.durations = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.durations.clear()
+
+    def span(self, name):
+        """Context manager recording the duration of its block as `name`."""
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start)
+
+    def add(self, name, start, duration):
+        """Record a span.
+
+        Args:
+            name (str): stage name.
+            start (float): `time.perf_counter` at the start of the stage.
+            duration (float): duration of the stage in seconds.
+        """
+        with self.lock:
+            self.events.append(
+                (name, start, duration, threading.get_ident()))
+            if name not in self.durations:
+                self.durations[name] = collections.deque(maxlen=self.window)
+            self.durations[name].append(duration)
+
+    def breakdown(self):
+        """Mean duration in seconds of the recent spans of each name."""
+        with self.lock:
+            return collections.OrderedDict(
+                (name, sum(durations) / len(durations))
+                for name, durations in self.durations.items())
+
+    def summary(self):
+        """One line rolling latency breakdown, e.g. 'pick 2.1ms | ...'."""
+        return ' | '.join('{} {:.1f}ms'.format(name, duration * 1000)
+                          for name, duration in self.breakdown().items())
+
+    def dumpChromeTrace(self, filename):
+        """Write the recorded spans in the Chrome trace event format.
+
+        Args:
+            filename (str): JSON file to be written.
+        """
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace = {
+            'traceEvents': [{
+                'name': name,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': tid,
+            } for name, start, duration, tid in events],
+            'displayTimeUnit': 'ms',
+        }
+        with open(filename, 'w') as f:
+            json.dump(trace, f)
+
+
+# Tracer of the application
+tracer = Tracer()
@@ -0,0 +1,93 @@
+"""Cell selection of a mesh backed by a boolean mask.
+
+Set operations are vectorized over the mask, the selection is only wrapped
+as VTK objects where VTK needs it.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+class Selection(object):
+    """Selected cells of a mesh.
+
+    Args:
+        numberOfCells (int): number of cells of the mesh.
+        mask (np.ndarray): bool mask of the selected cells, None for an empty
+            selection. The mask is used as is, not copied.
+    """
+
+    def __init__(self, numberOfCells, mask=None):
+        if mask is None:
+            mask = np.zeros(numberOfCells, dtype=bool)
+        elif mask.shape != (numberOfCells, ) or mask.dtype != bool:
+            raise ValueError('mask must be a bool array of {} cells.'.format(
+                numberOfCells))
+        self.mask = mask
+
+    @classmethod
+    def fromIds(cls, numberOfCells, ids):
+        """Build a selection from cell ids.
+
+        Args:
+            numberOfCells (int): number of cells of the mesh.
+            ids (np.ndarray or vtkIdTypeArray): selected cell ids.
+        """
+        if isinstance(ids, vtk.vtkDataArray):
+            ids = numpy_support.vtk_to_numpy(ids)
+        mask = np.zeros(numberOfCells, dtype=bool)
+        mask[np.asarray(ids, dtype=np.int64)] = True
+        return cls(numberOfCells, mask)
+
+    @property
+    def numberOfCells(self):
+        return self.mask.shape[0]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+    def __bool__(self):
+        return bool(self.mask.any())
+
+    def __eq__(self, other):
+        return isinstance(other, Selection) and np.array_equal(
+            self.mask, other.mask)
+
+    def copy(self):
+        return Selection(self.numberOfCells, self.mask.copy())
+
+    def union(self, other):
+        return Selection(self.numberOfCells, self.mask | other.mask)
+
+    def difference(self, other):
+        return Selection(self.numberOfCells, self.mask & ~other.mask)
+
+    def intersection(self, other):
+        return Selection(self.numberOfCells, self.mask & other.mask)
+
+    def complement(self):
+        return Selection(self.numberOfCells, ~self.mask)
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+    __invert__ = complement
+
+    def ids(self):
+        """Sorted ids of the selected cells."""
+        return np.flatnonzero(self.mask)
+
+    def toIdArray(self):
+        """Selected cell ids as a vtkIdTypeArray sharing the id buffer."""
+        return numpy_support.numpy_to_vtkIdTypeArray(self.ids())
+
+    def toVtkSelection(self):
+        """Selected cells as a vtkSelection of cell indices."""
+        selectionNode = vtk.vtkSelectionNode()
+        selectionNode.SetFieldType(vtk.vtkSelectionNode.CELL)
+        selectionNode.SetContentType(vtk.vtkSelectionNode.INDICES)
+        selectionNode.SetSelectionList(self.toIdArray())
+
+        selection = vtk.vtkSelection()
+        selection.AddNode(selectionNode)
+        return selection
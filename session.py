@@ -0,0 +1,151 @@
+"""Labeling sessions saved next to the labeled mesh.
+
+A session holds the content hash of the mesh, the label array, the undo
+history of each class and the thresholds of the viewer in one `.npz` file,
+so that labeling resumes where it stopped. `Autosaver` writes sessions on a
+background thread, every few operations.
+"""
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from history import SelectionHistory
+
+# Version of the session file layout
+SESSION_VERSION = 1
+
+
+def sessionFilename(meshFilename):
+    """Session file of a mesh file, e.g. case.session.npz for case.stl."""
+    return os.path.splitext(meshFilename)[0] + '.session.npz'
+
+
+def saveSession(filename, state):
+    """Write a session file.
+
+    The file is written next to `filename` and moved over it, so that a
+    crash never leaves a truncated session.
+
+    Args:
+        filename (str): .npz file to be written.
+        state (dict): session with `meshHash`, `labels` (np.ndarray),
+            `activeClass` (int), `histories` (dict of SelectionHistory or of
+            their `toArrays` by class) and `settings` (dict of numbers and
+            strings).
+    """
+    arrays = {
+        'version': SESSION_VERSION,
+        'meshHash': state['meshHash'],
+        'labels': state['labels'],
+        'activeClass': state['activeClass'],
+        'classes': np.array(sorted(state['histories']), dtype=np.int64),
+    }
+    for label, history in state['histories'].items():
+        if isinstance(history, SelectionHistory):
+            history = history.toArrays()
+        for name, array in history.items():
+            arrays['history{}_{}'.format(label, name)] = array
+    for name, value in state['settings'].items():
+        arrays['setting_' + name] = value
+
+    temporary = filename + '.tmp.npz'
+    np.savez_compressed(temporary, **arrays)
+    os.replace(temporary, filename)
+
+
+def loadSession(filename, meshHash=None):
+    """Read a session file.
+
+    Args:
+        filename (str): .npz file written by `saveSession`.
+        meshHash (str): content hash of the mesh the session is restored
+            on, checked against the one of the file if given.
+
+    Returns:
+        dict: session as given to `saveSession`, with SelectionHistory
+            histories.
+    """
+    with np.load(filename) as arrays:
+        if int(arrays['version']) != SESSION_VERSION:
+            raise ValueError('{} has an unsupported version.'.format(filename))
+        if meshHash is not None and str(arrays['meshHash']) != meshHash:
+            raise ValueError(
+                '{} was saved for another mesh.'.format(filename))
+
+        histories = dict()
+        for label in arrays['classes'].tolist():
+            prefix = 'history{}_'.format(label)
+            histories[label] = SelectionHistory.fromArrays({
+                name[len(prefix):]: arrays[name]
+                for name in arrays.files if name.startswith(prefix)
+            })
+        settings = {
+            name[len('setting_'):]: arrays[name].item()
+            for name in arrays.files if name.startswith('setting_')
+        }
+        return {
+            'meshHash': str(arrays['meshHash']),
+            'labels': arrays['labels'],
+            'activeClass': int(arrays['activeClass']),
+            'histories': histories,
+            'settings': settings,
+        }
+
+
+class Autosaver(object):
+    """Background writer of session files.
+
+    Only the latest session of each file is written when several are queued,
+    and writing never blocks the caller.
+
+    Args:
+        interval (int): number of operations between two saves.
+        onError (callable): called with the error message when a save fails.
+    """
+
+    def __init__(self, interval=10, onError=None):
+        self.interval = interval
+        self.onError = onError
+        self.operations = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Latest queued save of each file
+        self.generations = dict()
+        self.lock = threading.Lock()
+
+    def count(self):
+        """Count an operation.
+
+        Returns:
+            bool: whether a save is due.
+        """
+        self.operations += 1
+        return self.operations % self.interval == 0
+
+    def save(self, filename, state):
+        """Write a session on the background thread.
+
+        Args:
+            filename (str): .npz file to be written.
+            state (dict): session of `saveSession`, not modified afterwards.
+        """
+        with self.lock:
+            generation = self.generations.get(filename, 0) + 1
+            self.generations[filename] = generation
+        self.executor.submit(self._save, generation, filename, state)
+
+    def _save(self, generation, filename, state):
+        with self.lock:
+            if generation != self.generations[filename]:
+                return
+        try:
+            saveSession(filename, state)
+        except Exception as e:
+            traceback.print_exc()
+            if self.onError is not None:
+                self.onError('Failed to autosave {}: {}'.format(filename, e))
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
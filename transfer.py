@@ -0,0 +1,105 @@
+"""Label transfer between aligned meshes.
+
+Pre-labels a new scan from a labeled scan of the same patient or a
+registered template: each cell of the target takes the label of the nearest
+source cell, by cell centroid. Cells whose nearest source cell is too far
+or faces another way are left unlabeled for the annotator.
+
+Usage:
+    python transfer.py SOURCE.vtp TARGET.stl -o TARGET.vtp --max-distance 0.5
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from algorithm import getCellCentroids, getCellNormals
+from dataset import readLabeledMesh
+from labelmap import UNLABELED
+from lod import NearestPoint
+from vtkio import asLabels, labelPolyData, readSTLFast, writeLabels, writeVTP
+
+
+def transferLabels(source,
+                   sourceLabels,
+                   target,
+                   maxDistance=None,
+                   maxAngle=None):
+    """Label the cells of a mesh from the nearest cells of a labeled mesh.
+
+    Args:
+        source (vtkPolyData): labeled mesh, aligned with `target`.
+        sourceLabels (np.ndarray): label of each cell of `source`.
+        target (vtkPolyData): mesh to be labeled.
+        maxDistance (float): cells farther than this from their nearest
+            source cell, centroid to centroid, are left unlabeled.
+        maxAngle (float): cells whose normal is more than this angle in
+            degrees away from the one of their nearest source cell are left
+            unlabeled.
+
+    Returns:
+        np.ndarray: label of each cell of `target`, of the dtype of
+            `vtkio.asLabels`.
+    """
+    sourceLabels = asLabels(sourceLabels)
+    sourceCentroids = getCellCentroids(source)
+    targetCentroids = getCellCentroids(target)
+    nearest = NearestPoint(sourceCentroids)(targetCentroids)
+    labels = sourceLabels[nearest]
+
+    if maxDistance is not None:
+        distances = np.linalg.norm(
+            sourceCentroids[nearest] - targetCentroids, axis=1)
+        labels[distances > maxDistance] = UNLABELED
+    if maxAngle is not None:
+        sourceNormals = _outwardNormals(source)
+        targetNormals = _outwardNormals(target)
+        cosines = np.einsum('ij,ij->i', sourceNormals[nearest], targetNormals)
+        labels[cosines < np.cos(np.radians(maxAngle))] = UNLABELED
+    return labels
+
+
+def _outwardNormals(polyData):
+    """Cell normals of a mesh, flipped if they mostly point inward."""
+    normals = getCellNormals(polyData)
+    centroids = getCellCentroids(polyData)
+    if np.einsum('ij,ij->', normals, centroids - centroids.mean(axis=0)) < 0:
+        return -normals
+    return normals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Label a mesh from an aligned labeled mesh.')
+    parser.add_argument('source',
+                        help='labeled mesh: VTP, VTK, or STL next to its '
+                        'label file')
+    parser.add_argument('target', help='STL file to be labeled')
+    parser.add_argument('-o', '--output', required=True,
+                        help='labeled VTP file, or label file (.npz)')
+    parser.add_argument('--max-distance', type=float,
+                        help='leave cells farther than this (mm) unlabeled')
+    parser.add_argument('--max-angle', type=float,
+                        help='leave cells whose normal differs by more than '
+                        'this (degrees) unlabeled')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    source, sourceLabels, _ = readLabeledMesh(args.source)
+    target = readSTLFast(args.target)
+    labels = transferLabels(source, sourceLabels, target, args.max_distance,
+                            args.max_angle)
+    if args.output.endswith('.npz'):
+        writeLabels(target, labels, args.output)
+    else:
+        writeVTP(labelPolyData(target, labels), args.output)
+
+    print('{}: {} of {} cells labeled in {:.2f}s'.format(
+        args.output, np.count_nonzero(labels), labels.shape[0],
+        time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
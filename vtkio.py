@@ -1,4 +1,11 @@
+import hashlib
+import os
+
+import numpy as np
 import vtk
+from vtk.util import numpy_support
+
+from labelmap import labelDtype
 
 def readSTL(filename):
     reader = vtk.vtkSTLReader()
@@ -7,14 +14,249 @@ def readSTL(filename):
 
     return reader.GetOutput()
 
-def writeVTP(polyData, filename):
-    """Wrtie VTP file.
-    
+
+# Record of a triangle in a binary STL file
+STL_TRIANGLE = np.dtype([('normal', '<f4', (3, )), ('vertices', '<f4', (3, 3)),
+                         ('attribute', '<u2')])
+
+
+def readSTLFast(filename):
+    """Read a STL file with NumPy, welding duplicate vertices.
+
+    Binary files are memory-mapped and their triangles viewed as a
+    structured array, vertices are welded with a vectorized unique and the
+    mesh is built on zero-copy VTK arrays. The result matches `readSTL`:
+    points are numbered by first appearance and triangles collapsed by the
+    welding are dropped, so cell ids are the same. ASCII files are read
+    with `readSTL`.
+
+    Args:
+        filename (str): STL file to be read.
+
+    Returns:
+        vtkPolyData: mesh of the file.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        f.seek(80)
+        header = f.read(4)
+    if len(header) < 4:
+        return readSTL(filename)
+    numberOfTriangles = int(np.frombuffer(header, '<u4')[0])
+    if size != 84 + numberOfTriangles * STL_TRIANGLE.itemsize:
+        return readSTL(filename)
+
+    if numberOfTriangles > 0:
+        triangles = np.memmap(filename, dtype=STL_TRIANGLE, mode='r',
+                              offset=84, shape=(numberOfTriangles, ))
+        # Adding 0 turns -0.0 into 0.0 so that both weld together
+        vertices = triangles['vertices'].reshape(-1, 3) + np.float32(0)
+    else:
+        vertices = np.zeros((0, 3), dtype=np.float32)
+    first, inverse = _weld(np.ascontiguousarray(vertices))
+    # Number the welded points by first appearance
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.shape[0])
+    connectivity = rank[inverse].reshape(-1, 3)
+    pointCoords = np.ascontiguousarray(vertices[first[order]])
+
+    valid = ((connectivity[:, 0] != connectivity[:, 1]) &
+             (connectivity[:, 0] != connectivity[:, 2]) &
+             (connectivity[:, 1] != connectivity[:, 2]))
+    connectivity = np.ascontiguousarray(connectivity[valid].ravel(),
+                                        dtype=np.int64)
+    offsets = np.arange(0, connectivity.shape[0] + 1, 3, dtype=np.int64)
+
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(pointCoords))
+    polys = vtk.vtkCellArray()
+    polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets),
+                  numpy_support.numpy_to_vtkIdTypeArray(connectivity))
+
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(points)
+    polyData.SetPolys(polys)
+    return polyData
+
+
+def _weld(vertices):
+    """Group identical vertices.
+
+    Vertices are grouped by a 64 bit hash of their coordinates, checked
+    against the coordinates themselves; exact byte-wise grouping is used
+    in the unlikely case of a collision.
+
+    Args:
+        vertices (np.ndarray): (N, 3) contiguous float32 coordinates.
+
+    Returns:
+        tuple: index of the first vertex of each group, and group of each
+            vertex.
+    """
+    bits = vertices.view(np.uint32).astype(np.uint64)
+    keys = ((bits[:, 0] * np.uint64(0x9E3779B97F4A7C15)) ^
+            (bits[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)) ^
+            (bits[:, 2] * np.uint64(0x165667B19E3779F9)))
+    order = np.argsort(keys)
+    sortedKeys = keys[order]
+    starts = np.ones(order.shape[0], dtype=bool)
+    starts[1:] = sortedKeys[1:] != sortedKeys[:-1]
+    first = np.minimum.reduceat(order, np.flatnonzero(starts)) if \
+        order.shape[0] > 0 else order
+    inverse = np.empty_like(order)
+    inverse[order] = np.cumsum(starts) - 1
+
+    if np.array_equal(vertices[first[inverse]], vertices):
+        return first, inverse
+
+    _, first, inverse = np.unique(
+        vertices.view(np.dtype((np.void, 12))).ravel(),
+        return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+def asLabels(cellLabels):
+    """Cell labels (or bool) as a uint8 array, uint16 past 255 classes."""
+    cellLabels = np.asarray(cellLabels)
+    if cellLabels.dtype in (np.uint8, np.uint16):
+        return cellLabels
+    maximum = int(cellLabels.max()) if cellLabels.shape[0] > 0 else 0
+    return cellLabels.astype(labelDtype(maximum))
+
+
+def pointLabelsFromCells(polyData, cellLabels):
+    """Label the points of a mesh from its cell labels.
+
+    A point takes the highest label of the cells using it, straight from the
+    polys connectivity; with binary labels a point is labeled 1 when any
+    cell using it is labeled.
+
+    Args:
+        polyData (vtkPolyData): mesh made of polys.
+        cellLabels (np.ndarray): label (or bool) of each cell.
+
+    Returns:
+        np.ndarray: label of each point, of the dtype of `asLabels`.
+    """
+    cellLabels = asLabels(cellLabels)
+    polys = polyData.GetPolys()
+    offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+    connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+    labelOfCorner = np.repeat(cellLabels, np.diff(offsets))
+    labeled = labelOfCorner != 0
+    pointLabels = np.zeros(polyData.GetNumberOfPoints(),
+                           dtype=cellLabels.dtype)
+    np.maximum.at(pointLabels, connectivity[labeled], labelOfCorner[labeled])
+    return pointLabels
+
+
+def labelPolyData(polyData, cellLabels):
+    """Shallow copy of a mesh with cell and point labels attached as scalars.
+
+    The copy shares the geometry of `polyData`. Point labels are given by
+    `pointLabelsFromCells`.
+
+    Args:
+        polyData (vtkPolyData): mesh to be labeled, made of polys.
+        cellLabels (np.ndarray): label (or bool) of each cell.
+
+    Returns:
+        vtkPolyData: labeled copy of the mesh.
+    """
+    labeled = vtk.vtkPolyData()
+    labeled.ShallowCopy(polyData)
+    # Cell Label
+    cellLabels = asLabels(cellLabels)
+    labeled.GetCellData().SetScalars(numpy_support.numpy_to_vtk(cellLabels))
+    # Point Label
+    labeled.GetPointData().SetScalars(
+        numpy_support.numpy_to_vtk(pointLabelsFromCells(polyData,
+                                                        cellLabels)))
+    return labeled
+
+
+def meshHash(polyData):
+    """Content hash of the geometry (points and polys) of a mesh.
+
+    Args:
+        polyData (vtkPolyData): mesh to be hashed.
+
+    Returns:
+        str: hexadecimal SHA-1 digest.
+    """
+    digest = hashlib.sha1()
+    if polyData.GetNumberOfPoints() > 0:
+        points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+        digest.update(np.ascontiguousarray(points, np.float32).tobytes())
+    polys = polyData.GetPolys()
+    for array in (polys.GetOffsetsArray(), polys.GetConnectivityArray()):
+        digest.update(
+            np.ascontiguousarray(numpy_support.vtk_to_numpy(array),
+                                 np.int64).tobytes())
+    return digest.hexdigest()
+
+
+COMPRESSORS = {
+    'zlib': vtk.vtkZLibDataCompressor,
+    'lz4': vtk.vtkLZ4DataCompressor,
+    'none': None,
+}
+
+
+def writeVTP(polyData, filename, compression='zlib'):
+    """Write XML VTP file with binary appended data.
+
     Args:
         polyData (vtkPolyData): pd to be written.
         filename (str): filename of written file.
+        compression (str): compression of the data, one of `COMPRESSORS`.
     """
-    writer = vtk.vtkPolyDataWriter()
+    if compression not in COMPRESSORS:
+        raise ValueError('Unknown compression: {}'.format(compression))
+
+    writer = vtk.vtkXMLPolyDataWriter()
     writer.SetFileName(filename)
     writer.SetInputData(polyData)
-    writer.Write()
\ No newline at end of file
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    if COMPRESSORS[compression] is None:
+        writer.SetCompressorTypeToNone()
+    else:
+        writer.SetCompressor(COMPRESSORS[compression]())
+    if writer.Write() != 1:
+        raise IOError('Failed to write {}'.format(filename))
+
+
+def writeLabels(polyData, cellLabels, filename):
+    """Write the labels of a mesh to a sidecar file, without the geometry.
+
+    Args:
+        polyData (vtkPolyData): labeled mesh.
+        cellLabels (np.ndarray): label (or bool) of each cell.
+        filename (str): .npz file to be written.
+    """
+    cellLabels = asLabels(cellLabels)
+    np.savez_compressed(filename,
+                        cellLabels=cellLabels,
+                        pointLabels=pointLabelsFromCells(polyData, cellLabels),
+                        meshHash=meshHash(polyData))
+
+
+def readLabels(filename, polyData=None):
+    """Read a label sidecar file.
+
+    Args:
+        filename (str): .npz file written by `writeLabels`.
+        polyData (vtkPolyData): mesh the labels belong to, checked against
+            the mesh hash of the file if given.
+
+    Returns:
+        tuple: cell labels and point labels.
+    """
+    with np.load(filename) as labels:
+        if polyData is not None and str(
+                labels['meshHash']) != meshHash(polyData):
+            raise ValueError(
+                '{} was written for another mesh.'.format(filename))
+        return labels['cellLabels'], labels['pointLabels']